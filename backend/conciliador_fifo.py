@@ -5,6 +5,35 @@ import pandas as pd
 from pathlib import Path
 from reconciliation import generate_reconciliation_data
 
+def run(input_path, tol=0.01, ar_prefix="43", ap_prefix="40,41", output_path=None, sheet_filter=None):
+    """Ejecuta la conciliación sobre un Excel y escribe el resultado.
+
+    Punto de entrada programático (p. ej. desde Streamlit) que evita pagar
+    el arranque del intérprete y la re-importación de pandas por ejecución.
+    Devuelve (output_path, summary).
+    """
+    input_path = Path(input_path)
+    content = input_path.read_bytes()
+    out_sheets, summary, company_name, period = generate_reconciliation_data(
+        content,
+        tol,
+        ar_prefix,
+        ap_prefix,
+        sheet_filter=sheet_filter
+    )
+
+    if not output_path:
+        output_path = input_path.with_name(input_path.stem + "_conciliado.xlsx")
+
+    # Ojo: constant_memory no sirve aquí — to_excel escribe el cuerpo por
+    # columnas y ese modo descarta en silencio las escrituras a filas ya
+    # volcadas, corrompiendo todas las hojas
+    with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
+        for name, data in out_sheets.items():
+            data.to_excel(writer, sheet_name=name[:31], index=False)
+
+    return output_path, summary
+
 def main():
     parser = argparse.ArgumentParser(description="Conciliador FIFO AR/AP")
     parser.add_argument("input", help="Ruta al Excel de entrada")
@@ -13,38 +42,30 @@ def main():
     parser.add_argument("--ar-prefix", default="43", help="Prefijo Clientes (AR)")
     parser.add_argument("--ap-prefix", default="40,41", help="Prefijo Proveedores (AP), separados por comas")
     parser.add_argument("--tol", type=float, default=0.01, help="Tolerancia")
-    
+
     args = parser.parse_args()
-    
+
     input_path = Path(args.input)
     if not input_path.exists():
         print(f"Error: No se encuentra el archivo {input_path}")
         sys.exit(1)
-        
+
     print(f"Procesando {input_path}...")
-    
+
     try:
-        content = input_path.read_bytes()
-        out_sheets, summary, company_name, period = generate_reconciliation_data(
-            content,
-            args.tol,
-            args.ar_prefix,
-            args.ap_prefix,
+        output_path, summary = run(
+            input_path,
+            tol=args.tol,
+            ar_prefix=args.ar_prefix,
+            ap_prefix=args.ap_prefix,
+            output_path=args.output,
             sheet_filter=args.sheet
         )
-        
-        output_path = args.output
-        if not output_path:
-            output_path = input_path.with_name(input_path.stem + "_conciliado.xlsx")
-            
-        with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
-            for name, data in out_sheets.items():
-                data.to_excel(writer, sheet_name=name[:31], index=False)
-                
+
         print(f"Conciliación completada. Guardado en: {output_path}")
         print("\nResumen:")
         print(pd.DataFrame(summary))
-        
+
     except Exception as e:
         print(f"Error durante el proceso: {e}")
         import traceback
@@ -7,6 +7,7 @@ from typing import Annotated, Optional
 
 from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from sqlalchemy import func, select
@@ -34,6 +35,9 @@ app = FastAPI(
     description="Accounting reconciliation tool for matching invoices with payments",
     version="2.0.0",
     lifespan=lifespan,
+    # orjson serializes the large /conciliate payloads (detail records are
+    # plain Python scalars by construction) far faster than the stdlib encoder
+    default_response_class=ORJSONResponse,
 )
 
 # CORS configuration
@@ -2,9 +2,40 @@ import pandas as pd
 import numpy as np
 import re
 import io
+from collections import defaultdict
+from functools import lru_cache
 from typing import List, Dict, Tuple, Optional, Any
 from difflib import SequenceMatcher
 
+try:
+    # Optional: rapidfuzz batches reference scoring in C (process.cdist).
+    # When missing we fall back to the difflib-based pairwise loop.
+    from rapidfuzz import fuzz as _rf_fuzz
+    from rapidfuzz import process as _rf_process
+except ImportError:
+    _rf_fuzz = None
+    _rf_process = None
+
+try:
+    # Optional: joblib parallelizes per-tercero reconciliation across cores.
+    from joblib import Parallel, delayed
+except ImportError:
+    Parallel = None
+    delayed = None
+
+def _open_excel(file_content: bytes) -> pd.ExcelFile:
+    """Open a workbook, preferring the calamine engine when available.
+
+    python-calamine reads xlsx several times faster than openpyxl; fall back
+    to pandas' default engine when it is not installed (or the pandas version
+    does not know the engine).
+    """
+    try:
+        return pd.ExcelFile(io.BytesIO(file_content), engine="calamine")
+    except (ImportError, ValueError):
+        return pd.ExcelFile(io.BytesIO(file_content))
+
+
 def _coerce_european_numbers(series: pd.Series) -> pd.Series:
     """Auto-detect European number format (1.234,56) and convert to standard floats.
 
@@ -26,11 +57,15 @@ def _coerce_european_numbers(series: pd.Series) -> pd.Series:
     return pd.to_numeric(series, errors="coerce")
 
 
+@lru_cache(maxsize=256)
+def _normalized_cols_cached(cols: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Cached column normalization (multi-sheet files repeat the same header)."""
+    return tuple(re.sub(r"\s+", " ", c).strip().lower() for c in cols)
+
+
 def normalize_cols(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
-    df.columns = [str(c).strip() for c in df.columns]
-    lower_map = {c: re.sub(r"\s+", " ", str(c)).strip().lower() for c in df.columns}
-    df.rename(columns=lower_map, inplace=True)
+    df.columns = list(_normalized_cols_cached(tuple(str(c) for c in df.columns)))
     return df
 
 def find_col(df: pd.DataFrame, patterns: List[str]) -> Optional[str]:
@@ -85,19 +120,53 @@ def find_header_row(df_head: pd.DataFrame) -> int:
         return 0
     return best_idx
 
+def _header_names(header_cells: pd.Series) -> List[str]:
+    """Turn a raw header row into column names the way read_excel would.
+
+    Empty cells become "Unnamed: {i}" and duplicates get a ".{n}" suffix,
+    so a sheet resliced below its header keeps the same column names as a
+    second read_excel(header=...) call would have produced.
+    """
+    names = []
+    seen: Dict[str, int] = {}
+    for i, val in enumerate(header_cells):
+        name = f"Unnamed: {i}" if pd.isna(val) else str(val)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
 def detect_schema(df: pd.DataFrame) -> Dict[str, Optional[str]]:
-    # print(f"[DEBUG] Detecting schema from columns: {list(df.columns)[:10]}...")
+    # Thin wrapper: sheets of the same export share one header, so the regex
+    # sweep is cached on the tuple of column names.
+    return dict(_detect_schema_cached(tuple(df.columns)))
+
+
+@lru_cache(maxsize=256)
+def _detect_schema_cached(cols: Tuple[str, ...]) -> Tuple[Tuple[str, Optional[str]], ...]:
+    def _find(patterns):
+        for p in patterns:
+            for c in cols:
+                if re.search(p, c, flags=re.IGNORECASE):
+                    return c
+        return None
+
+    # print(f"[DEBUG] Detecting schema from columns: {list(cols)[:10]}...")
     # Extended patterns for Spanish, Catalan and English
-    date_col   = find_col(df, [r"fecha", r"data", r"date", r"f\.?contab", r"asiento.*fecha"])
-    cuenta_col = find_col(df, [r"cuenta", r"compte", r"cta", r"account", r"cod.*cta"])
-    debe_col   = find_col(df, [r"debe", r"deure", r"cargo", r"càrrec", r"debit"])
-    haber_col  = find_col(df, [r"haber", r"haver", r"abono", r"abonament", r"credit", r"crèdit"])
-    saldo_col  = find_col(df, [r"saldo", r"balance"])
-    tercero_col= find_col(df, [r"descripci[oó]n", r"descripc", r"proveedor", r"proveïdor", r"cliente", r"client", r"tercero", r"tercer", r"contrapartida", r"nombre", r"nom", r"raz[oó]n\s*social"])
-    doc_col    = find_col(df, [r"factura", r"documento", r"document", r"n[ºo]\s*doc", r"n[úu]mero", r"número", r"ref"])
-    concepto_col=find_col(df, [r"concepto", r"concepte", r"desc", r"glosa", r"detalle", r"detall", r"narr"])
+    date_col   = _find([r"fecha", r"data", r"date", r"f\.?contab", r"asiento.*fecha"])
+    cuenta_col = _find([r"cuenta", r"compte", r"cta", r"account", r"cod.*cta"])
+    debe_col   = _find([r"debe", r"deure", r"cargo", r"càrrec", r"debit"])
+    haber_col  = _find([r"haber", r"haver", r"abono", r"abonament", r"credit", r"crèdit"])
+    saldo_col  = _find([r"saldo", r"balance"])
+    tercero_col= _find([r"descripci[oó]n", r"descripc", r"proveedor", r"proveïdor", r"cliente", r"client", r"tercero", r"tercer", r"contrapartida", r"nombre", r"nom", r"raz[oó]n\s*social"])
+    doc_col    = _find([r"factura", r"documento", r"document", r"n[ºo]\s*doc", r"n[úu]mero", r"número", r"ref"])
+    concepto_col=_find([r"concepto", r"concepte", r"desc", r"glosa", r"detalle", r"detall", r"narr"])
     # Detect pre-reconciled column (Punt. / Punteado / Check / Reconciled)
-    punt_col   = find_col(df, [r"punt\.?$", r"punteado", r"puntejat", r"check", r"reconciled", r"conciliado", r"conciliat"])
+    punt_col   = _find([r"punt\.?$", r"punteado", r"puntejat", r"check", r"reconciled", r"conciliado", r"conciliat"])
 
     schema = {
         "fecha": date_col, "cuenta": cuenta_col, "debe": debe_col, "haber": haber_col,
@@ -108,8 +177,7 @@ def detect_schema(df: pd.DataFrame) -> Dict[str, Optional[str]]:
     # Fallback for headless sheets
     if not (schema["fecha"] and schema["cuenta"] and (schema["debe"] or schema["haber"])):
         # print(f"[DEBUG] Schema detection failed, using fallback. Detected schema: {schema}")
-        if len(df.columns) >= 9:
-            cols = list(df.columns)
+        if len(cols) >= 9:
             schema = {
                 "cuenta": cols[0],
                 "tercero": cols[1],
@@ -121,7 +189,7 @@ def detect_schema(df: pd.DataFrame) -> Dict[str, Optional[str]]:
                 "haber": cols[7],
                 "saldo": cols[8]
             }
-    return schema
+    return tuple(schema.items())
 
 _WITHHOLDING_RATES = (0.07, 0.15, 0.19, 0.21)
 
@@ -152,8 +220,23 @@ def extract_invoice_references(text: str) -> List[str]:
     """Extract potential invoice references from text using common patterns, including ranges"""
     if not text:
         return []
+    structured, fallback = _extract_refs_split(str(text))
+    return list(structured) + list(fallback)
+
 
-    text = str(text).upper()
+@lru_cache(maxsize=16384)
+def _extract_refs_split(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Cached core of extract_invoice_references, split into two tiers.
+
+    Returns (structured_refs, fallback_tokens): structured refs come from the
+    range/list/pattern branches; fallback tokens are the text split on
+    separators, pruned by the stoplist and length filter. Both tiers feed the
+    matching candidates. Concepts and document numbers repeat
+    heavily across a ledger (same payment concept for every installment, same
+    doc per invoice/payment pair), so memoizing the regex work pays off on
+    large files.
+    """
+    text = text.upper()
     references = []
 
     # First, detect ranges of invoices (e.g., "Fact 1234-1236" or "Fra. 1000 a 1003")
@@ -229,28 +312,36 @@ def extract_invoice_references(text: str) -> List[str]:
         matches = re.findall(pattern, text)
         references.extend(matches)
 
-    # Also include the full text split by common separators for partial matching
-    # This helps when invoice ref doesn't follow standard patterns
-    text_parts = re.split(r'[\s,;/\-]+', text)
-    references.extend([p for p in text_parts if len(p) >= 3 and not p.isspace() and p not in _REFERENCE_STOPLIST])
-
     # Remove duplicates while preserving order
     seen = set()
-    unique_refs = []
+    structured = []
     for ref in references:
         if ref and ref not in seen:
             seen.add(ref)
-            unique_refs.append(ref)
+            structured.append(ref)
 
-    return unique_refs
+    # Also include the full text split by common separators for partial matching
+    # This helps when invoice ref doesn't follow standard patterns
+    fallback = []
+    for p in re.split(r'[\s,;/\-]+', text):
+        if len(p) >= 3 and not p.isspace() and p not in _REFERENCE_STOPLIST and p not in seen:
+            seen.add(p)
+            fallback.append(p)
+
+    return tuple(structured), tuple(fallback)
 
 def fuzzy_match_score(str1: str, str2: str, threshold: float = 0.8) -> float:
     """Calculate fuzzy match score between two strings (0-1)"""
     if not str1 or not str2:
         return 0.0
+    return _fuzzy_match_score_cached(str(str1), str(str2), threshold)
 
-    str1 = str(str1).upper().strip()
-    str2 = str(str2).upper().strip()
+
+@lru_cache(maxsize=16384)
+def _fuzzy_match_score_cached(str1: str, str2: str, threshold: float) -> float:
+    """Cached core of fuzzy_match_score (same ref pairs recur across payments)."""
+    str1 = str1.upper().strip()
+    str2 = str2.upper().strip()
 
     # Exact match
     if str1 == str2:
@@ -365,27 +456,112 @@ def extract_period(df_head: pd.DataFrame, header_row: int) -> Optional[str]:
 
 
 class Reconciler:
+    _INITIAL_CAP = 64
+
+    # Output columns in stable order. Accumulating one list per column (and
+    # building the DataFrame from the dict of lists) avoids hashing the same
+    # dozen keys for every output row and pandas' per-row type inference.
+    _OUT_COLUMNS = (
+        "SetID", "Tercero", "Fecha_doc", "Fecha_pago", "DocKey", "PagoKey",
+        "Asignado", "ResidualFacturaTras", "Hoja_doc", "Hoja_pago",
+        "MatchMethod", "Confidence",
+        "Cuenta_doc", "Documento_doc", "Concepto_doc",
+        "Cuenta_pago", "Documento_pago", "Concepto_pago",
+        "Suggestion", "SuggestedAction", "SuggestionConfidence",
+    )
+
     def __init__(self, tol: float = 0.01):
         self.tol = tol
-        self.open_invoices = []  # List of dicts
-        self.out_rows = []
+        self.open_invoices = []  # List of dicts (cold metadata per invoice)
+        self.out_cols: Dict[str, List[Any]] = {c: [] for c in self._OUT_COLUMNS}
         self.set_id = 0
+        # Hot fields in SoA layout: remaining amounts and invoice dates live
+        # in parallel numpy arrays so the scan phases can run as C-level
+        # vector ops instead of per-dict lookups. self._n is the live length.
+        self._n = 0
+        self._remaining = np.zeros(self._INITIAL_CAP, dtype=np.float64)
+        self._fechas = np.full(self._INITIAL_CAP, np.datetime64("NaT"), dtype="datetime64[ns]")
+        # Index of open invoices keyed by amount bucket (remaining / tol),
+        # so the exact-amount phase finds candidates in O(1) instead of
+        # scanning every open invoice per payment.
+        self._amount_index: Dict[int, List[int]] = defaultdict(list)
+        # Fully paid invoices stay in place as tombstones; this counts them so
+        # compaction can be deferred until they dominate the list.
+        self._closed_count = 0
+
+    def _amount_bucket(self, amount: float) -> int:
+        return int(round(amount / self.tol)) if self.tol > 0 else int(round(amount * 100))
+
+    def _reduce_remaining(self, idx: int, take: float) -> None:
+        """Decrease an invoice's open amount and keep the amount index in sync."""
+        old_remaining = self._remaining[idx]
+        old_bucket = self._amount_bucket(old_remaining)
+        new_remaining = old_remaining - take
+        self._remaining[idx] = new_remaining
+        bucket = self._amount_index.get(old_bucket)
+        if bucket is not None:
+            try:
+                bucket.remove(idx)
+            except ValueError:
+                pass
+            if not bucket:
+                del self._amount_index[old_bucket]
+        if new_remaining > self.tol:
+            self._amount_index[self._amount_bucket(new_remaining)].append(idx)
+        else:
+            self._closed_count += 1
+
+    def _rebuild_amount_index(self) -> None:
+        self._amount_index.clear()
+        for idx in range(self._n):
+            if self._remaining[idx] > self.tol:
+                self._amount_index[self._amount_bucket(self._remaining[idx])].append(idx)
+
+    def _append_out(self, row: Dict[str, Any]) -> None:
+        """Append one output row into the columnar accumulators.
+
+        Columns absent from the row (e.g. the Suggestion fields, which only
+        Unallocated payments fill in) are padded with None.
+        """
+        cols = self.out_cols
+        for name in self._OUT_COLUMNS:
+            cols[name].append(row.get(name))
+
+    def _open_invoice_dicts(self) -> List[Dict]:
+        """Snapshot the still-open invoices as dicts (for the suggestion helper)."""
+        return [
+            {**self.open_invoices[idx], "remaining": float(self._remaining[idx])}
+            for idx in range(self._n)
+            if self._remaining[idx] > self.tol
+        ]
 
     def add_invoice(self, row):
         # Extract multiple possible references from document field
+        # (structured refs plus filtered fallback tokens)
         doc_refs = []
         if row["doc"]:
             doc_refs = extract_invoice_references(str(row["doc"]))
 
+        if self._n == len(self._remaining):
+            # Amortized doubling of the SoA arrays
+            self._remaining = np.resize(self._remaining, self._n * 2)
+            self._fechas = np.resize(self._fechas, self._n * 2)
+
         self.open_invoices.append({
             "doc_key": row["doc_key"],
-            "remaining": float(row["neto_norm"]),
             "fecha": row["fecha"],
             "row_id": row["row_id"],
             "doc_ref": str(row["doc"]).lower().strip() if row["doc"] else "",
             "doc_refs": doc_refs,  # Multiple possible references
             "original_row": row
         })
+        amount = float(row["neto_norm"])
+        self._remaining[self._n] = amount
+        self._fechas[self._n] = (
+            pd.Timestamp(row["fecha"]).to_datetime64() if pd.notna(row["fecha"]) else np.datetime64("NaT")
+        )
+        self._amount_index[self._amount_bucket(amount)].append(self._n)
+        self._n += 1
 
     def process_payment(self, payment_row, tercero):
         payment_amount = -float(payment_row["neto_norm"])
@@ -393,7 +569,9 @@ class Reconciler:
         payment_concept = str(payment_row["concepto"]).lower() if payment_row["concepto"] else ""
         payment_date = payment_row["fecha"]
 
-        # Extract potential references from payment concept
+        # Extract potential references from payment concept. The stoplist and
+        # length filter already prune obvious junk tokens, so Phase 1 only
+        # short-circuits when no candidate at all survives.
         payment_refs = extract_invoice_references(payment_concept) if payment_concept else []
 
         matches = [] # List of (invoice_index, amount_to_take, method, confidence)
@@ -402,25 +580,49 @@ class Reconciler:
         if payment_left > self.tol and (payment_concept or payment_row.get("doc")):
             best_ref_matches = []
 
+            # Collect still-open invoices once. Exact substring matches
+            # (legacy behavior for compatibility) act as a floor score for
+            # whichever fuzzy backend runs below.
+            open_positions = []
+            base_scores = []
+            flat_refs = []
+            ref_owner = []  # position in open_positions owning each flat ref
             for idx, inv in enumerate(self.open_invoices):
-                if inv["remaining"] <= self.tol:
+                if self._remaining[idx] <= self.tol:
                     continue
-
-                max_score = 0.0
-
-                # Check exact substring match (legacy behavior for compatibility)
-                if len(inv["doc_ref"]) >= 3 and inv["doc_ref"] in payment_concept:
-                    max_score = 0.95
-
-                # Check against extracted references with fuzzy matching
-                for inv_ref in inv["doc_refs"]:
-                    for pay_ref in payment_refs:
-                        score = fuzzy_match_score(inv_ref, pay_ref, threshold=0.7)
-                        if score > max_score:
-                            max_score = score
-
-                if max_score >= 0.7:  # Threshold for considering a reference match
-                    best_ref_matches.append((idx, max_score))
+                substr_score = 0.95 if len(inv["doc_ref"]) >= 3 and inv["doc_ref"] in payment_concept else 0.0
+                open_positions.append(idx)
+                base_scores.append(substr_score)
+                # Exact substring hit is already a match: skip fuzzy work for it
+                if payment_refs and substr_score == 0.0:
+                    for inv_ref in inv["doc_refs"]:
+                        flat_refs.append(inv_ref)
+                        ref_owner.append(len(open_positions) - 1)
+
+            if _rf_process is not None:
+                # One C-level cdist call computes the payment_ref x invoice_ref
+                # score matrix instead of a Python call per pair.
+                best_scores = np.asarray(base_scores, dtype=np.float64)
+                if flat_refs:
+                    score_matrix = _rf_process.cdist(
+                        payment_refs, flat_refs, scorer=_rf_fuzz.WRatio, score_cutoff=70,
+                    )
+                    np.maximum.at(best_scores, ref_owner, score_matrix.max(axis=0) / 100.0)
+                for pos, idx in enumerate(open_positions):
+                    if best_scores[pos] >= 0.7:  # Threshold for considering a reference match
+                        best_ref_matches.append((idx, float(best_scores[pos])))
+            else:
+                # difflib fallback: pairwise fuzzy scoring as before
+                for pos, idx in enumerate(open_positions):
+                    max_score = base_scores[pos]
+                    if max_score < 0.95:  # substring hit already decides
+                        for inv_ref in self.open_invoices[idx]["doc_refs"]:
+                            for pay_ref in payment_refs:
+                                score = fuzzy_match_score(inv_ref, pay_ref, threshold=0.7)
+                                if score > max_score:
+                                    max_score = score
+                    if max_score >= 0.7:  # Threshold for considering a reference match
+                        best_ref_matches.append((idx, max_score))
 
             # Sort by score and process best matches first
             best_ref_matches.sort(key=lambda x: x[1], reverse=True)
@@ -428,37 +630,59 @@ class Reconciler:
             for idx, score in best_ref_matches:
                 if payment_left <= self.tol:
                     break
-                inv = self.open_invoices[idx]
-                if inv["remaining"] > self.tol:
-                    take = min(inv["remaining"], payment_left)
+                if self._remaining[idx] > self.tol:
+                    take = min(float(self._remaining[idx]), payment_left)
                     # Confidence: 95-100% for perfect match, 80-95% for fuzzy match
                     confidence = min(95 + (score * 5), 100) if score >= 0.9 else 80 + (score * 15)
                     matches.append((idx, take, "Reference", confidence))
-                    inv["remaining"] -= take
+                    self._reduce_remaining(idx, take)
                     payment_left -= take
 
         # --- Phase 2: Exact Amount Match ---
         if payment_left > self.tol:
+            # Probe the amount index instead of scanning every open invoice.
+            # The effective tolerance can span a few adjacent buckets.
+            tol_eff = max(self.tol, payment_left * 0.001)
+            lo = self._amount_bucket(payment_left - tol_eff)
+            hi = self._amount_bucket(payment_left + tol_eff)
             candidates = []
-            for idx, inv in enumerate(self.open_invoices):
-                if inv["remaining"] <= self.tol:
-                    continue
-                if abs(inv["remaining"] - payment_left) <= max(self.tol, payment_left * 0.001):
-                    candidates.append(idx)
+            if hi - lo + 1 <= len(self._amount_index):
+                for bucket_key in range(lo, hi + 1):
+                    for idx in self._amount_index.get(bucket_key, ()):
+                        if self._remaining[idx] > self.tol and abs(self._remaining[idx] - payment_left) <= tol_eff:
+                            candidates.append(idx)
+            else:
+                # tol_eff grows with the payment, so for large amounts the
+                # bucket range can dwarf the handful of occupied buckets;
+                # iterate the index's keys instead of probing every bucket
+                for bucket_key, bucket in self._amount_index.items():
+                    if lo <= bucket_key <= hi:
+                        for idx in bucket:
+                            if self._remaining[idx] > self.tol and abs(self._remaining[idx] - payment_left) <= tol_eff:
+                                candidates.append(idx)
+            candidates.sort()  # keep FIFO preference when dates don't decide
 
             if candidates:
-                # Prefer candidates closer in date
-                if payment_date and payment_date != pd.NaT:
-                    candidates.sort(key=lambda idx: abs((self.open_invoices[idx]["fecha"] - payment_date).days)
-                                    if self.open_invoices[idx]["fecha"] != pd.NaT else 999999)
-
+                # Prefer the candidate closest in date. The hot dates already
+                # live in the datetime64 SoA array, so this is one vector
+                # subtraction + argmin instead of a Timestamp-math sort per
+                # payment; argmin's first-hit tie-breaking keeps the FIFO
+                # preference (candidates are in ascending index order).
                 best_match_idx = candidates[0]
+                if pd.notna(payment_date) and len(candidates) > 1:
+                    cand = np.asarray(candidates)
+                    diffs = np.abs(
+                        (pd.Timestamp(payment_date).to_datetime64() - self._fechas[cand])
+                        .astype("timedelta64[D]").astype(np.float64)
+                    )
+                    diffs = np.where(np.isnan(diffs), np.inf, diffs)  # undated invoices last
+                    best_match_idx = int(cand[int(np.argmin(diffs))])
                 take = payment_left
                 # Higher confidence if dates are close
-                days_diff = abs((self.open_invoices[best_match_idx]["fecha"] - payment_date).days) if payment_date != pd.NaT and self.open_invoices[best_match_idx]["fecha"] != pd.NaT else 999
+                days_diff = abs((self.open_invoices[best_match_idx]["fecha"] - payment_date).days) if pd.notna(payment_date) and pd.notna(self.open_invoices[best_match_idx]["fecha"]) else 999
                 confidence = 90 if days_diff <= 30 else 85 if days_diff <= 60 else 80
                 matches.append((best_match_idx, take, "Exact", confidence))
-                self.open_invoices[best_match_idx]["remaining"] -= take
+                self._reduce_remaining(best_match_idx, take)
                 payment_left -= take
 
         # --- Phase 2.5: Withholding Tax (IRPF) Match ---
@@ -467,16 +691,16 @@ class Reconciler:
             best_wh_match = None  # (inv_idx, rate, confidence)
 
             for idx, inv in enumerate(self.open_invoices):
-                if inv["remaining"] <= self.tol:
+                if self._remaining[idx] <= self.tol:
                     continue
 
                 # Try each withholding rate, lowest first (less assumption)
                 for rate in _WITHHOLDING_RATES:
-                    expected_payment = inv["remaining"] * (1 - rate)
+                    expected_payment = self._remaining[idx] * (1 - rate)
                     if abs(expected_payment - payment_left) <= max(self.tol, payment_left * 0.001):
                         # Date proximity bonus
                         days_diff = 999
-                        if payment_date and payment_date != pd.NaT and inv["fecha"] and inv["fecha"] != pd.NaT:
+                        if pd.notna(payment_date) and pd.notna(inv["fecha"]):
                             days_diff = abs((payment_date - inv["fecha"]).days)
                         confidence = 88 if days_diff <= 30 else 85 if days_diff <= 60 else 82
 
@@ -486,21 +710,18 @@ class Reconciler:
 
             if best_wh_match:
                 wh_idx, wh_rate, wh_confidence = best_wh_match
-                inv = self.open_invoices[wh_idx]
                 # Take the payment amount from the invoice (residual = withheld portion)
                 take = payment_left
                 matches.append((wh_idx, take, "WithholdingTax", wh_confidence))
-                inv["remaining"] -= take
+                self._reduce_remaining(wh_idx, take)
                 payment_left -= take
 
         # --- Phase 3: Combined Amount Match (Multiple Invoices) ---
         # Try to find combinations of 2-3 invoices that sum to the payment amount
         if payment_left > self.tol:
-            # Get all open invoices with their amounts
-            open_inv_indices = []
-            for idx, inv in enumerate(self.open_invoices):
-                if inv["remaining"] > self.tol:
-                    open_inv_indices.append((idx, inv["remaining"]))
+            # Get all open invoices with their amounts (one vectorized scan)
+            open_idx = np.where(self._remaining[:self._n] > self.tol)[0]
+            open_inv_indices = [(int(i), float(self._remaining[i])) for i in open_idx]
 
             # Try combinations of 2 invoices first
             if len(open_inv_indices) >= 2:
@@ -516,15 +737,15 @@ class Reconciler:
                             confidence = 85  # High confidence for exact combination
 
                             # Match first invoice
-                            take1 = min(self.open_invoices[idx1]["remaining"], amount1)
+                            take1 = min(float(self._remaining[idx1]), amount1)
                             matches.append((idx1, take1, "CombinedAmount", confidence))
-                            self.open_invoices[idx1]["remaining"] -= take1
+                            self._reduce_remaining(idx1, take1)
                             payment_left -= take1
 
                             # Match second invoice
-                            take2 = min(self.open_invoices[idx2]["remaining"], amount2)
+                            take2 = min(float(self._remaining[idx2]), amount2)
                             matches.append((idx2, take2, "CombinedAmount", confidence))
-                            self.open_invoices[idx2]["remaining"] -= take2
+                            self._reduce_remaining(idx2, take2)
                             payment_left -= take2
                             break
                     if payment_left <= self.tol:
@@ -532,10 +753,8 @@ class Reconciler:
 
             # Rebuild open_inv_indices after 2-combo matching (some may have been consumed)
             if payment_left > self.tol:
-                open_inv_indices = []
-                for idx, inv in enumerate(self.open_invoices):
-                    if inv["remaining"] > self.tol:
-                        open_inv_indices.append((idx, inv["remaining"]))
+                open_idx = np.where(self._remaining[:self._n] > self.tol)[0]
+                open_inv_indices = [(int(i), float(self._remaining[i])) for i in open_idx]
 
             # Try combinations of 3 invoices if still unmatched
             if payment_left > self.tol and len(open_inv_indices) >= 3:
@@ -553,10 +772,10 @@ class Reconciler:
 
                                 # Match all three invoices
                                 for idx, amount in [(idx1, amount1), (idx2, amount2), (idx3, amount3)]:
-                                    if self.open_invoices[idx]["remaining"] > self.tol:
-                                        take = min(self.open_invoices[idx]["remaining"], amount)
+                                    if self._remaining[idx] > self.tol:
+                                        take = min(float(self._remaining[idx]), amount)
                                         matches.append((idx, take, "CombinedAmount", confidence))
-                                        self.open_invoices[idx]["remaining"] -= take
+                                        self._reduce_remaining(idx, take)
                                         payment_left -= take
                                 break
                         if payment_left <= self.tol:
@@ -565,30 +784,28 @@ class Reconciler:
                         break
 
         # --- Phase 4: Date Proximity Match ---
-        if payment_left > self.tol and payment_date and payment_date != pd.NaT:
-            proximity_candidates = []
-
-            for idx, inv in enumerate(self.open_invoices):
-                if inv["remaining"] <= self.tol:
-                    continue
-
-                inv_date = inv["fecha"]
-                if inv_date and inv_date != pd.NaT:
-                    days_diff = (payment_date - inv_date).days
-                    # Payment within -30 to 45 days of invoice (allows advance payments)
-                    if -30 <= days_diff <= 45:
-                        # Check if amount is reasonably close (within 20%)
-                        amount_ratio = payment_left / inv["remaining"] if inv["remaining"] > 0 else 0
-                        if 0.8 <= amount_ratio <= 1.2:
-                            proximity_candidates.append((idx, days_diff, amount_ratio))
-
-            if proximity_candidates:
-                # Sort by absolute days difference (prefer closest dates)
-                proximity_candidates.sort(key=lambda x: abs(x[1]))
-                best_idx, days_diff, amount_ratio = proximity_candidates[0]
-
-                if self.open_invoices[best_idx]["remaining"] > self.tol:
-                    take = min(self.open_invoices[best_idx]["remaining"], payment_left)
+        if payment_left > self.tol and pd.notna(payment_date):
+            # Vectorized over the SoA arrays: NaT dates yield NaN day counts,
+            # which fail every comparison and drop out of the mask naturally.
+            rem = self._remaining[:self._n]
+            days = (
+                pd.Timestamp(payment_date).to_datetime64() - self._fechas[:self._n]
+            ).astype("timedelta64[D]").astype(np.float64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = payment_left / np.where(rem > 0, rem, np.inf)
+            # Payment within -30 to 45 days of invoice (allows advance payments)
+            # and amount reasonably close (within 20%)
+            mask = (days >= -30) & (days <= 45) & (ratio >= 0.8) & (ratio <= 1.2) & (rem > self.tol)
+            candidates = np.where(mask)[0]
+
+            if candidates.size:
+                # Prefer the closest date (argmin keeps the earliest invoice on ties)
+                best_idx = int(candidates[np.argmin(np.abs(days[candidates]))])
+                days_diff = int(days[best_idx])
+                amount_ratio = float(ratio[best_idx])
+
+                if self._remaining[best_idx] > self.tol:
+                    take = min(float(self._remaining[best_idx]), payment_left)
                     # Confidence based on date proximity and amount match
                     # Advance payments (days_diff < 0) use lower base confidence
                     base_confidence = 70 if days_diff < 0 else 75
@@ -596,25 +813,31 @@ class Reconciler:
                     amount_confidence = 70 if 0.95 <= amount_ratio <= 1.05 else 65
                     confidence = min(date_confidence, amount_confidence)
                     matches.append((best_idx, take, "DateProximity", confidence))
-                    self.open_invoices[best_idx]["remaining"] -= take
+                    self._reduce_remaining(best_idx, take)
                     payment_left -= take
 
         # --- Phase 5: FIFO Fallback ---
         # Enhanced FIFO: More aggressive matching for partial and split payments
         if payment_left > self.tol:
+            # Head of the FIFO queue: tombstones keep closed invoices in
+            # place, so "first" means the first slot that is still open
+            first_open = next(
+                (i for i in range(self._n) if self._remaining[i] > self.tol), None
+            )
             for idx, inv in enumerate(self.open_invoices):
-                if inv["remaining"] <= self.tol:
+                remaining = float(self._remaining[idx])
+                if remaining <= self.tol:
                     continue
 
                 # Allow partial payment allocation regardless of amount
-                take = min(inv["remaining"], payment_left)
+                take = min(remaining, payment_left)
 
                 # Calculate dynamic confidence for FIFO matches
                 confidence = 45  # Base confidence for FIFO (increased from 40)
 
                 # Factor 1: Amount coverage ratio (does payment cover invoice well?)
-                if inv["remaining"] > 0:
-                    coverage_ratio = take / inv["remaining"]
+                if remaining > 0:
+                    coverage_ratio = take / remaining
                     if 0.90 <= coverage_ratio <= 1.10:
                         confidence += 15  # Payment covers 90-110% of invoice (increased)
                     elif 0.80 <= coverage_ratio <= 1.20:
@@ -623,7 +846,7 @@ class Reconciler:
                         confidence += 5   # At least 40% coverage
 
                 # Factor 2: Date proximity (more flexible for real-world delays)
-                if payment_date and payment_date != pd.NaT and inv["fecha"] and inv["fecha"] != pd.NaT:
+                if pd.notna(payment_date) and pd.notna(inv["fecha"]):
                     days_diff = (payment_date - inv["fecha"]).days
                     if days_diff >= -30:  # Payment from 30 days before invoice
                         if days_diff <= 45:
@@ -636,18 +859,18 @@ class Reconciler:
                             confidence += 5   # Within 180 days
 
                 # Factor 3: Position in queue (is this the first/oldest invoice?)
-                if idx == 0:
-                    confidence += 5  # First invoice in FIFO queue
+                if idx == first_open:
+                    confidence += 5  # First open invoice in FIFO queue
 
                 # Factor 4: Boost for clean allocations
-                if abs(take - payment_left) < self.tol or abs(take - inv["remaining"]) < self.tol:
+                if abs(take - payment_left) < self.tol or abs(take - remaining) < self.tol:
                     confidence += 5  # Fully allocates payment or invoice
 
                 # Cap confidence at reasonable max for FIFO
                 confidence = min(confidence, 75)  # Increased cap
 
                 matches.append((idx, take, "FIFO", confidence))
-                inv["remaining"] -= take
+                self._reduce_remaining(idx, take)
                 payment_left -= take
                 if payment_left <= self.tol:
                     break
@@ -662,7 +885,7 @@ class Reconciler:
                 confidence = 50  # Default confidence
 
             inv = self.open_invoices[idx]
-            self.out_rows.append({
+            self._append_out({
                 "SetID": self.set_id,
                 "Tercero": tercero,
                 "Fecha_doc": inv["fecha"],
@@ -670,7 +893,7 @@ class Reconciler:
                 "DocKey": inv["doc_key"],
                 "PagoKey": payment_row["doc_key"],
                 "Asignado": take,
-                "ResidualFacturaTras": inv["remaining"],
+                "ResidualFacturaTras": float(self._remaining[idx]),
                 "Hoja_doc": inv["original_row"]["hoja"],
                 "Hoja_pago": payment_row["hoja"],
                 "MatchMethod": method,
@@ -685,8 +908,18 @@ class Reconciler:
                 "Concepto_pago": payment_row["concepto"]
             })
 
-        # Cleanup fully paid invoices
-        self.open_invoices = [inv for inv in self.open_invoices if inv["remaining"] > self.tol]
+        # Fully paid invoices stay in place as tombstones — every scan above
+        # already skips remaining <= tol. Compact (and reindex, since indices
+        # shift) only once closed entries dominate, keeping cleanup amortized
+        # O(1) per payment instead of an O(N) rebuild every time.
+        if self._closed_count > self._n // 2:
+            keep = np.where(self._remaining[:self._n] > self.tol)[0]
+            self.open_invoices = [self.open_invoices[i] for i in keep]
+            self._remaining[:len(keep)] = self._remaining[keep]
+            self._fechas[:len(keep)] = self._fechas[keep]
+            self._n = len(keep)
+            self._closed_count = 0
+            self._rebuild_amount_index()
 
         # Handle Unallocated Payment
         if payment_left > self.tol:
@@ -717,7 +950,7 @@ class Reconciler:
             # Generate suggestion for why it wasn't matched
             suggestion = generate_unmatched_suggestions(
                 pd.Series(unmatched_row),
-                self.open_invoices,
+                self._open_invoice_dicts(),
                 recent_history=None  # Could be enhanced with payment history
             )
 
@@ -726,7 +959,7 @@ class Reconciler:
             unmatched_row["SuggestedAction"] = suggestion.get("action", "")
             unmatched_row["SuggestionConfidence"] = suggestion.get("confidence", 0)
 
-            self.out_rows.append(unmatched_row)
+            self._append_out(unmatched_row)
             
         # Check if set is closed (no open invoices and no running payment)
         # In this row-by-row logic, we check if we are "clean".
@@ -739,9 +972,12 @@ class Reconciler:
             self.set_id += 1
 
     def flush_remaining(self, tercero):
-        # Output remaining open invoices as unallocated
-        for inv in self.open_invoices:
-            self.out_rows.append({
+        # Output remaining open invoices as unallocated (skip tombstones)
+        for idx in range(self._n):
+            if self._remaining[idx] <= self.tol:
+                continue
+            inv = self.open_invoices[idx]
+            self._append_out({
                 "SetID": self.set_id,
                 "Tercero": tercero,
                 "Fecha_doc": inv["fecha"],
@@ -749,7 +985,7 @@ class Reconciler:
                 "DocKey": inv["doc_key"],
                 "PagoKey": None,
                 "Asignado": 0.0,
-                "ResidualFacturaTras": inv["remaining"],
+                "ResidualFacturaTras": float(self._remaining[idx]),
                 "Hoja_doc": inv["original_row"]["hoja"],
                 "Hoja_pago": None,
                 "MatchMethod": "Open",
@@ -764,199 +1000,243 @@ class Reconciler:
                 "Concepto_pago": None
             })
 
-def reconcile_fifo(df: pd.DataFrame, tol: float = 0.01) -> pd.DataFrame:
-    all_rows = []
+def _reconcile_tercero(tercero, g: pd.DataFrame, tol: float, has_pre_reconciled: bool) -> List[pd.DataFrame]:
+    """Reconcile one tercero's movements and return its output frames.
 
-    # Check if pre_reconciled column exists
-    has_pre_reconciled = "pre_reconciled" in df.columns
+    Module-level (rather than a closure) so joblib can pickle it out to the
+    loky worker processes.
+    """
+    frames = []
+    reconciler = Reconciler(tol=tol)
+    pre_reconciled_rows = []  # Store pre-reconciled movements separately
+
+    # Pull the needed columns out as raw arrays once — iterating plain
+    # Python values is far cheaper than boxing every row into a pd.Series
+    # with iterrows on large ledgers.
+    rows = [
+        {
+            "hoja": hoja, "fecha": fecha, "doc": doc, "concepto": concepto,
+            "cuenta": cuenta, "neto_norm": neto, "row_id": row_id,
+            "doc_key": doc_key, "idx": ix,
+        }
+        for hoja, fecha, doc, concepto, cuenta, neto, row_id, doc_key, ix in zip(
+            g["hoja"].to_numpy(object),
+            list(g["fecha"]),  # keep pd.Timestamp/NaT semantics for date math
+            g["doc"].to_numpy(object),
+            g["concepto"].to_numpy(object),
+            g["cuenta"].to_numpy(object),
+            g["neto_norm"].to_numpy(dtype=np.float64),
+            g["row_id"].to_numpy(),
+            g["doc_key"].to_numpy(object),
+            g["idx"].to_numpy(),
+        )
+    ]
+    pre_flags = (
+        g["pre_reconciled"].to_numpy(dtype=bool)
+        if has_pre_reconciled else np.zeros(len(rows), dtype=bool)
+    )
+
+    # Rows already arrive sorted by (fecha, idx) from the outer sort, so a
+    # single chronological pass dispatches invoices and payments in order.
+    # This helps with split payments and advance payments.
+    for row, is_pre_reconciled in zip(rows, pre_flags):
+        amount = float(row["neto_norm"] or 0.0)
+        if is_pre_reconciled:
+            # Don't process pre-reconciled items - just record them
+            pre_reconciled_rows.append({
+                "row": row,
+                "amount": amount,
+                "is_invoice": amount > 0
+            })
+        elif amount > 0:
+            reconciler.add_invoice(row)
+        elif amount < 0:
+            reconciler.process_payment(row, tercero)
+
+    reconciler.flush_remaining(tercero)
+
+    # Post-processing: Try to match unallocated payments with open invoices
+    # This handles cases where payments come before invoices
+    rows_df = pd.DataFrame(reconciler.out_cols)
+    if not rows_df.empty:
+        unallocated = rows_df[rows_df["MatchMethod"] == "Unallocated"]
+
+        if not unallocated.empty:
+            for _, payment in unallocated.iterrows():
+                payment_amount = abs(payment["Asignado"])
+
+                # Re-query open invoices each iteration to avoid stale data
+                open_invs = rows_df[rows_df["MatchMethod"] == "Open"]
+                if open_invs.empty:
+                    break
 
-    # Work per tercero
-    # Sort by date to ensure chronological processing
-    for tercero, g in df.sort_values(["tercero", "fecha", "idx"]).groupby(["tercero"], dropna=False):
-        reconciler = Reconciler(tol=tol)
-        pre_reconciled_rows = []  # Store pre-reconciled movements separately
-
-        # Collect all movements for this tercero
-        invoices = []
-        payments = []
-
-        for _, row in g.iterrows():
-            # Check if this movement is pre-reconciled
-            is_pre_reconciled = has_pre_reconciled and row.get("pre_reconciled", False)
-
-            amount = float(row["neto_norm"] or 0.0)
-            if is_pre_reconciled:
-                # Don't process pre-reconciled items - just record them
-                pre_reconciled_rows.append({
-                    "row": row,
-                    "amount": amount,
-                    "is_invoice": amount > 0
-                })
-            elif amount > 0:
-                invoices.append(row)
-            elif amount < 0:
-                payments.append(row)
-
-        # Process in chronological order but with awareness of future movements
-        # This helps with split payments and advance payments
-        all_movements = sorted(invoices + payments, key=lambda x: (x["fecha"], x["idx"]))
-
-        for row in all_movements:
-            amount = float(row["neto_norm"] or 0.0)
-            if amount > 0:
-                reconciler.add_invoice(row)
-            elif amount < 0:
-                reconciler.process_payment(row, tercero)
-
-        reconciler.flush_remaining(tercero)
-
-        # Post-processing: Try to match unallocated payments with open invoices
-        # This handles cases where payments come before invoices
-        rows_df = pd.DataFrame(reconciler.out_rows)
-        if not rows_df.empty:
-            unallocated = rows_df[rows_df["MatchMethod"] == "Unallocated"]
-
-            if not unallocated.empty:
-                for _, payment in unallocated.iterrows():
-                    payment_amount = abs(payment["Asignado"])
-
-                    # Re-query open invoices each iteration to avoid stale data
-                    open_invs = rows_df[rows_df["MatchMethod"] == "Open"]
-                    if open_invs.empty:
-                        break
+                # Find best matching open invoice
+                for _, invoice in open_invs.iterrows():
+                    invoice_amount = invoice["ResidualFacturaTras"]
+                    if pd.isna(invoice_amount) or invoice_amount <= tol:
+                        continue
+
+                    # Check if payment matches invoice (exact match within tolerance)
+                    if abs(payment_amount - invoice_amount) < tol:
+                        # Update the rows to show they're matched
+                        pay_idx = rows_df.index[rows_df["PagoKey"] == payment["PagoKey"]].tolist()
+                        inv_idx = rows_df.index[rows_df["DocKey"] == invoice["DocKey"]].tolist()
+
+                        if pay_idx and inv_idx:
+                            rows_df.loc[pay_idx[0], "MatchMethod"] = "PostProcessed"
+                            rows_df.loc[pay_idx[0], "Confidence"] = 60
+                            rows_df.loc[pay_idx[0], "Asignado"] = -payment_amount
+                            rows_df.loc[inv_idx[0], "MatchMethod"] = "PostProcessed"
+                            rows_df.loc[inv_idx[0], "Confidence"] = 60
+                            rows_df.loc[inv_idx[0], "ResidualFacturaTras"] = 0.0
+                            break
 
-                    # Find best matching open invoice
-                    for _, invoice in open_invs.iterrows():
-                        invoice_amount = invoice["ResidualFacturaTras"]
-                        if pd.isna(invoice_amount) or invoice_amount <= tol:
+        # Post-processing pass 2: Credit note + payment combination
+        # Among remaining unallocated payments, identify credit notes by keywords.
+        # Try: regular_payment + credit_note ≈ open_invoice (1+1=1 only)
+        _CREDIT_NOTE_KEYWORDS = ("ABONO", "N/C", "NOTA CREDITO", "NOTA CRÈDIT",
+                                 "RECTIFICATIVA", "DEVOLUCION", "DEVOLUCIÓ", "CREDIT NOTE")
+
+        still_unallocated = rows_df[rows_df["MatchMethod"] == "Unallocated"].copy()
+        if len(still_unallocated) >= 2:
+            # Split into credit notes and regular payments
+            def _is_credit_note(row):
+                concept = str(row.get("Concepto_pago", "")).upper()
+                doc = str(row.get("Documento_pago", "")).upper()
+                return any(kw in concept or kw in doc for kw in _CREDIT_NOTE_KEYWORDS)
+
+            credit_notes = still_unallocated[still_unallocated.apply(_is_credit_note, axis=1)]
+            regular_payments = still_unallocated[~still_unallocated.apply(_is_credit_note, axis=1)]
+
+            for _, cn in credit_notes.iterrows():
+                cn_amount = abs(cn["Asignado"])
+                for _, reg in regular_payments.iterrows():
+                    # Skip if already matched in this loop
+                    reg_idx_list = rows_df.index[rows_df["PagoKey"] == reg["PagoKey"]].tolist()
+                    if reg_idx_list and rows_df.loc[reg_idx_list[0], "MatchMethod"] != "Unallocated":
+                        continue
+
+                    reg_amount = abs(reg["Asignado"])
+                    net_amount = reg_amount - cn_amount  # credit note reduces payment
+
+                    if net_amount <= tol:
+                        continue
+
+                    # Find an open invoice matching the net amount
+                    open_invs = rows_df[rows_df["MatchMethod"] == "Open"]
+                    for _, inv in open_invs.iterrows():
+                        inv_amount = inv["ResidualFacturaTras"]
+                        if pd.isna(inv_amount) or inv_amount <= tol:
                             continue
 
-                        # Check if payment matches invoice (exact match within tolerance)
-                        if abs(payment_amount - invoice_amount) < tol:
-                            # Update the rows to show they're matched
-                            pay_idx = rows_df.index[rows_df["PagoKey"] == payment["PagoKey"]].tolist()
-                            inv_idx = rows_df.index[rows_df["DocKey"] == invoice["DocKey"]].tolist()
+                        if abs(net_amount - inv_amount) <= max(tol, inv_amount * 0.01):
+                            # Found a match: reg_payment - credit_note ≈ invoice
+                            pay_idx = rows_df.index[rows_df["PagoKey"] == reg["PagoKey"]].tolist()
+                            cn_idx = rows_df.index[rows_df["PagoKey"] == cn["PagoKey"]].tolist()
+                            inv_idx = rows_df.index[rows_df["DocKey"] == inv["DocKey"]].tolist()
 
-                            if pay_idx and inv_idx:
+                            if pay_idx and cn_idx and inv_idx:
                                 rows_df.loc[pay_idx[0], "MatchMethod"] = "PostProcessed"
-                                rows_df.loc[pay_idx[0], "Confidence"] = 60
-                                rows_df.loc[pay_idx[0], "Asignado"] = -payment_amount
+                                rows_df.loc[pay_idx[0], "Confidence"] = 55
+                                rows_df.loc[cn_idx[0], "MatchMethod"] = "PostProcessed"
+                                rows_df.loc[cn_idx[0], "Confidence"] = 55
                                 rows_df.loc[inv_idx[0], "MatchMethod"] = "PostProcessed"
-                                rows_df.loc[inv_idx[0], "Confidence"] = 60
+                                rows_df.loc[inv_idx[0], "Confidence"] = 55
                                 rows_df.loc[inv_idx[0], "ResidualFacturaTras"] = 0.0
-                                break
+                            break  # one match per credit note
+
+        frames.append(rows_df)
+
+    # Add pre-reconciled rows (they were already matched in previous periods)
+    # These don't participate in new reconciliation but are recorded for completeness
+    pre_out = []
+    for pre_rec in pre_reconciled_rows:
+        row = pre_rec["row"]
+        amount = pre_rec["amount"]
+        is_invoice = pre_rec["is_invoice"]
+
+        if is_invoice:
+            # Pre-reconciled invoice
+            pre_out.append({
+                "SetID": reconciler.set_id,
+                "Tercero": tercero,
+                "Fecha_doc": row["fecha"],
+                "Fecha_pago": pd.NaT,
+                "DocKey": row["doc_key"],
+                "PagoKey": None,
+                "Asignado": amount,  # Fully assigned (matched in previous period)
+                "ResidualFacturaTras": 0.0,  # No residual
+                "Hoja_doc": row.get("hoja", ""),
+                "Hoja_pago": None,
+                "MatchMethod": "PreReconciled",  # Special status for pre-reconciled
+                "Confidence": 100,
+                "Cuenta_doc": row.get("cuenta", ""),
+                "Documento_doc": row.get("doc", ""),
+                "Concepto_doc": row.get("concepto", ""),
+                "Cuenta_pago": None,
+                "Documento_pago": None,
+                "Concepto_pago": None
+            })
+        else:
+            # Pre-reconciled payment
+            pre_out.append({
+                "SetID": reconciler.set_id,
+                "Tercero": tercero,
+                "Fecha_doc": pd.NaT,
+                "Fecha_pago": row["fecha"],
+                "DocKey": None,
+                "PagoKey": row["doc_key"],
+                "Asignado": amount,  # Negative (payment already matched)
+                "ResidualFacturaTras": None,
+                "Hoja_doc": None,
+                "Hoja_pago": row.get("hoja", ""),
+                "MatchMethod": "PreReconciled",
+                "Confidence": 100,
+                "Cuenta_doc": None,
+                "Documento_doc": None,
+                "Concepto_doc": None,
+                "Cuenta_pago": row.get("cuenta", ""),
+                "Documento_pago": row.get("doc", ""),
+                "Concepto_pago": row.get("concepto", "")
+            })
+    if pre_out:
+        frames.append(pd.DataFrame(pre_out))
 
-            # Post-processing pass 2: Credit note + payment combination
-            # Among remaining unallocated payments, identify credit notes by keywords.
-            # Try: regular_payment + credit_note ≈ open_invoice (1+1=1 only)
-            _CREDIT_NOTE_KEYWORDS = ("ABONO", "N/C", "NOTA CREDITO", "NOTA CRÈDIT",
-                                     "RECTIFICATIVA", "DEVOLUCION", "DEVOLUCIÓ", "CREDIT NOTE")
-
-            still_unallocated = rows_df[rows_df["MatchMethod"] == "Unallocated"].copy()
-            if len(still_unallocated) >= 2:
-                # Split into credit notes and regular payments
-                def _is_credit_note(row):
-                    concept = str(row.get("Concepto_pago", "")).upper()
-                    doc = str(row.get("Documento_pago", "")).upper()
-                    return any(kw in concept or kw in doc for kw in _CREDIT_NOTE_KEYWORDS)
-
-                credit_notes = still_unallocated[still_unallocated.apply(_is_credit_note, axis=1)]
-                regular_payments = still_unallocated[~still_unallocated.apply(_is_credit_note, axis=1)]
-
-                for _, cn in credit_notes.iterrows():
-                    cn_amount = abs(cn["Asignado"])
-                    for _, reg in regular_payments.iterrows():
-                        # Skip if already matched in this loop
-                        reg_idx_list = rows_df.index[rows_df["PagoKey"] == reg["PagoKey"]].tolist()
-                        if reg_idx_list and rows_df.loc[reg_idx_list[0], "MatchMethod"] != "Unallocated":
-                            continue
+    return frames
 
-                        reg_amount = abs(reg["Asignado"])
-                        net_amount = reg_amount - cn_amount  # credit note reduces payment
 
-                        if net_amount <= tol:
-                            continue
+def reconcile_fifo(df: pd.DataFrame, tol: float = 0.01) -> pd.DataFrame:
+    # Check if pre_reconciled column exists
+    has_pre_reconciled = "pre_reconciled" in df.columns
 
-                        # Find an open invoice matching the net amount
-                        open_invs = rows_df[rows_df["MatchMethod"] == "Open"]
-                        for _, inv in open_invs.iterrows():
-                            inv_amount = inv["ResidualFacturaTras"]
-                            if pd.isna(inv_amount) or inv_amount <= tol:
-                                continue
-
-                            if abs(net_amount - inv_amount) <= max(tol, inv_amount * 0.01):
-                                # Found a match: reg_payment - credit_note ≈ invoice
-                                pay_idx = rows_df.index[rows_df["PagoKey"] == reg["PagoKey"]].tolist()
-                                cn_idx = rows_df.index[rows_df["PagoKey"] == cn["PagoKey"]].tolist()
-                                inv_idx = rows_df.index[rows_df["DocKey"] == inv["DocKey"]].tolist()
-
-                                if pay_idx and cn_idx and inv_idx:
-                                    rows_df.loc[pay_idx[0], "MatchMethod"] = "PostProcessed"
-                                    rows_df.loc[pay_idx[0], "Confidence"] = 55
-                                    rows_df.loc[cn_idx[0], "MatchMethod"] = "PostProcessed"
-                                    rows_df.loc[cn_idx[0], "Confidence"] = 55
-                                    rows_df.loc[inv_idx[0], "MatchMethod"] = "PostProcessed"
-                                    rows_df.loc[inv_idx[0], "Confidence"] = 55
-                                    rows_df.loc[inv_idx[0], "ResidualFacturaTras"] = 0.0
-                                break  # one match per credit note
-
-            all_rows.extend(rows_df.to_dict('records'))
-        else:
-            all_rows.extend(reconciler.out_rows)
-
-        # Add pre-reconciled rows (they were already matched in previous periods)
-        # These don't participate in new reconciliation but are recorded for completeness
-        for pre_rec in pre_reconciled_rows:
-            row = pre_rec["row"]
-            amount = pre_rec["amount"]
-            is_invoice = pre_rec["is_invoice"]
-
-            if is_invoice:
-                # Pre-reconciled invoice
-                all_rows.append({
-                    "SetID": reconciler.set_id,
-                    "Tercero": tercero,
-                    "Fecha_doc": row["fecha"],
-                    "Fecha_pago": pd.NaT,
-                    "DocKey": row["doc_key"],
-                    "PagoKey": None,
-                    "Asignado": amount,  # Fully assigned (matched in previous period)
-                    "ResidualFacturaTras": 0.0,  # No residual
-                    "Hoja_doc": row.get("hoja", ""),
-                    "Hoja_pago": None,
-                    "MatchMethod": "PreReconciled",  # Special status for pre-reconciled
-                    "Confidence": 100,
-                    "Cuenta_doc": row.get("cuenta", ""),
-                    "Documento_doc": row.get("doc", ""),
-                    "Concepto_doc": row.get("concepto", ""),
-                    "Cuenta_pago": None,
-                    "Documento_pago": None,
-                    "Concepto_pago": None
-                })
-            else:
-                # Pre-reconciled payment
-                all_rows.append({
-                    "SetID": reconciler.set_id,
-                    "Tercero": tercero,
-                    "Fecha_doc": pd.NaT,
-                    "Fecha_pago": row["fecha"],
-                    "DocKey": None,
-                    "PagoKey": row["doc_key"],
-                    "Asignado": amount,  # Negative (payment already matched)
-                    "ResidualFacturaTras": None,
-                    "Hoja_doc": None,
-                    "Hoja_pago": row.get("hoja", ""),
-                    "MatchMethod": "PreReconciled",
-                    "Confidence": 100,
-                    "Cuenta_doc": None,
-                    "Documento_doc": None,
-                    "Concepto_doc": None,
-                    "Cuenta_pago": row.get("cuenta", ""),
-                    "Documento_pago": row.get("doc", ""),
-                    "Concepto_pago": row.get("concepto", "")
-                })
+    # Work per tercero
+    # Sort by date to ensure chronological processing. Each tercero's
+    # Reconciler state is independent, so with enough groups the work is
+    # fanned out across CPU cores via joblib; below that the process spawn
+    # cost outweighs the win and we stay sequential (also the fallback when
+    # joblib is not installed).
+    # Sort each group chronologically instead of stable-sorting the whole
+    # frame up front — groupby(sort=False) skips the global sort and only the
+    # per-tercero (fecha, idx) order actually matters to the reconciler.
+    groups = [
+        (tercero, g.sort_values(["fecha", "idx"], kind="mergesort"))
+        for tercero, g in df.groupby(["tercero"], dropna=False, sort=False)
+    ]
+    if Parallel is not None and len(groups) >= 32:
+        results = Parallel(n_jobs=-1, backend="loky", batch_size=16)(
+            delayed(_reconcile_tercero)(tercero, g, tol, has_pre_reconciled)
+            for tercero, g in groups
+        )
+    else:
+        results = [
+            _reconcile_tercero(tercero, g, tol, has_pre_reconciled)
+            for tercero, g in groups
+        ]
+    frames = [frame for result in results for frame in result]
 
-    return pd.DataFrame(all_rows)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
 
 def build_pendientes(det: pd.DataFrame, tol: float) -> pd.DataFrame:
     if det.empty:
@@ -1665,7 +1945,7 @@ def write_human_format_excel(
 
 
 def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str, ap_prefix: str, sheet_filter: Optional[str] = None) -> Tuple[Dict[str, pd.DataFrame], List[Dict], Optional[str], Optional[str]]:
-    xls = pd.ExcelFile(io.BytesIO(file_content))
+    xls = _open_excel(file_content)
 
     ar_rows = []
     ap_rows = []
@@ -1690,7 +1970,10 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
         if sheet_name not in xls.sheet_names:
             continue
 
-        df_head = pd.read_excel(xls, sheet_name=sheet_name, header=None, nrows=30)
+        # One raw read per sheet: locate the header in the first 30 rows and
+        # reslice below it, instead of parsing the whole sheet twice.
+        raw = pd.read_excel(xls, sheet_name=sheet_name, header=None)
+        df_head = raw.head(30)
         header_row = find_header_row(df_head)
 
         # Extract company name and period from first sheet only
@@ -1699,9 +1982,10 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
                 company_name = extract_company_name(df_head, header_row)
             if period is None:
                 period = extract_period(df_head, header_row)
-        
-        df0 = pd.read_excel(xls, sheet_name=sheet_name, header=header_row)
-        
+
+        df0 = raw.iloc[header_row + 1:].reset_index(drop=True)
+        df0.columns = _header_names(raw.iloc[header_row])
+
         df = normalize_cols(df0)
         sch = detect_schema(df)
         
@@ -1755,9 +2039,12 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
             
         meta_info["Filas_Procesables"] = len(df)
 
-        ap_prefixes = [p.strip() for p in ap_prefix.split(",")]
-        df["_collective"] = df[sch["cuenta"]].astype(str).str.strip().apply(
-            lambda s: "AR" if s.startswith(ar_prefix) else ("AP" if any(s.startswith(p) for p in ap_prefixes) else "OTROS")
+        ap_prefixes = tuple(p.strip() for p in ap_prefix.split(","))
+        cuenta_str = df[sch["cuenta"]].astype(str).str.strip()
+        df["_collective"] = np.select(
+            [cuenta_str.str.startswith(ar_prefix), cuenta_str.str.startswith(ap_prefixes)],
+            ["AR", "AP"],
+            default="OTROS",
         )
         
         counts = df["_collective"].value_counts().to_dict()
@@ -1778,11 +2065,10 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
 
         for coll, sub in df[df["_collective"].isin(["AR","AP"])].copy().groupby("_collective"):
             sub = sub.reset_index(drop=True)
-            net = sub[net_col].fillna(0).astype(float)
-            if coll == "AR":
-                net_norm = net # AR: Invoice > 0
-            else:
-                net_norm = -net # AP: Invoice > 0 (usually Credit in accounting, so we invert)
+            # Single coercion straight to a float64 array (na_value=0.0 covers
+            # the old fillna) instead of fillna + astype, each a full copy.
+            net = pd.to_numeric(sub[net_col], errors="coerce").to_numpy(dtype=np.float64, na_value=0.0)
+            net_norm = net if coll == "AR" else -net  # AP: Invoice > 0 (usually Credit in accounting, so we invert)
 
             # Check if movement is pre-reconciled (has "Sí" or similar in punt column)
             pre_reconciled = sub["_punt"].astype(str).str.strip().str.lower().isin(["sí", "si", "yes", "x", "✓", "true", "1"])
@@ -1799,10 +2085,14 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
                 "pre_reconciled": pre_reconciled,
             })
             work["row_id"] = work.index.values
-            work["doc_key"] = work.apply(
-                lambda r: (r["tercero"] or "") + " | " + (r["doc"] or f"{str(r['fecha'])[:10]}") + " | " + (r["cuenta"] or "") + " | " + f"{r['neto_norm']:+.2f}",
-                axis=1
+            # Build doc_key vectorially instead of a Python-level apply per row
+            tercero_s = work["tercero"].fillna("").astype(str)
+            doc_s = work["doc"].fillna(work["fecha"].astype(str).str.slice(0, 10))
+            neto_s = pd.Series(
+                np.char.mod("%+.2f", work["neto_norm"].to_numpy(dtype=np.float64)),
+                index=work.index,
             )
+            work["doc_key"] = tercero_s + " | " + doc_s + " | " + work["cuenta"].fillna("").astype(str) + " | " + neto_s
             if work["fecha"].isna().all():
                 work["fecha"] = pd.Timestamp("1900-01-01")
 
@@ -1842,6 +2132,7 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
                 "Bloque": name,
                 "Asignado": 0.0,
                 "Pagos_sin_factura": 0.0,
+                "Pagos_sin_factura_abs": 0.0,
                 "Docs_pendientes": 0
             }
         
@@ -1854,6 +2145,9 @@ def generate_reconciliation_data(file_content: bytes, tol: float, ar_prefix: str
             "Bloque": name,
             "Asignado": round(conciliado, 2),
             "Pagos_sin_factura": round(sin_factura, 2),
+            # Magnitud ya en positivo para que los consumidores (preview,
+            # frontend) formateen sin volver a aplicar abs() por render
+            "Pagos_sin_factura_abs": round(abs(sin_factura), 2),
             "Docs_pendientes": int(num_pendientes)
         }
 
@@ -2040,15 +2334,15 @@ def process_excel(file_content: bytes, tol: float, ar_prefix: str, ap_prefix: st
     if output_format == "human":
         # Human format: single sheet identical to manual reconciliation
         # Read original file to get structure
-        xls = pd.ExcelFile(io.BytesIO(file_content))
+        xls = _open_excel(file_content)
         sheet_name = 'Cuentas corrientes' if 'Cuentas corrientes' in xls.sheet_names else xls.sheet_names[0]
 
-        # Read without header first to find header row
+        # Read raw once: find the header in the first rows, then reslice
         original_df_raw = pd.read_excel(xls, sheet_name=sheet_name, header=None)
-        header_row_idx = find_header_row(original_df_raw)
+        header_row_idx = find_header_row(original_df_raw.head(30))
 
-        # Read with header
-        original_df = pd.read_excel(xls, sheet_name=sheet_name, header=header_row_idx)
+        original_df = original_df_raw.iloc[header_row_idx + 1:].reset_index(drop=True)
+        original_df.columns = _header_names(original_df_raw.iloc[header_row_idx])
         schema = detect_schema(original_df)
 
         # Get pending items
@@ -2096,32 +2390,47 @@ def process_excel(file_content: bytes, tol: float, ar_prefix: str, ap_prefix: st
         if name in ["Clientes_Detalle", "Proveedores_Detalle", "Pendientes_Clientes", "Pendientes_Proveedores"]:
             # Create a copy to avoid SettingWithCopy warnings
             df_clean = df.copy()
-            
-            # Replace Infinity with NaN first (numpy types)
-            df_clean.replace([np.inf, -np.inf], np.nan, inplace=True)
-            
+
             # Convert dates to string ISO format BEFORE replacing NaNs with None
-            # because datetime columns with None might be tricky
-            for col in df_clean.columns:
-                if pd.api.types.is_datetime64_any_dtype(df_clean[col]):
-                    df_clean[col] = df_clean[col].dt.strftime('%Y-%m-%d')
+            # because datetime columns with None might be tricky. One C-level
+            # cast to day precision per column instead of strftime per cell;
+            # the dtype kinds come from a single dtypes pass rather than an
+            # is_datetime64_any_dtype call (and Series view) per column.
+            dt_cols = [col for col, dt in df_clean.dtypes.items() if dt.kind == "M"]
+            for col in dt_cols:
+                vals = df_clean[col].to_numpy()
+                iso = vals.astype("datetime64[D]").astype(str).astype(object)
+                iso[np.isnat(vals)] = None
+                df_clean[col] = iso
             
-            # Now replace all NaN (including those from Inf) with None
-            # We use where(pd.notnull(df), None) pattern which is robust
-            df_clean = df_clean.where(pd.notnull(df_clean), None)
-            
-            details[name] = df_clean.to_dict(orient="records")
-
-    # Construct raw response
-    raw_response = {
-        "summary": summary_list,
+            # Per-column specialization: the dtype decides once how a column
+            # becomes JSON-clean (floats null out non-finite values, object
+            # columns null out NaN/NaT, the object cast itself turns numpy
+            # scalars into Python ones). No per-leaf isinstance dispatch and
+            # no whole-frame 2D mask.
+            cols = tuple(df_clean.columns)
+            col_objs = []
+            for col in cols:
+                vals = df_clean[col].to_numpy()
+                obj = vals.astype(object)
+                if vals.dtype.kind == "f":
+                    obj[~np.isfinite(vals)] = None
+                elif vals.dtype.kind == "O":
+                    obj[pd.isna(vals)] = None
+                col_objs.append(obj)
+            details[name] = [dict(zip(cols, row)) for row in zip(*col_objs)]
+
+    # Construct response. The detail records were already built clean above
+    # (dates are ISO strings, NaN/Inf turned into None, and the object cast
+    # yields plain Python scalars), so re-walking every leaf with the
+    # recursive sanitizer would be wasted work — only the small summary
+    # still needs it.
+    clean_response = {
+        "summary": recursive_sanitize(summary_list),
         "meta": [],
         "details": details,
         "company_name": company_name,
         "period": period
     }
-    
-    # Sanitize everything
-    clean_response = recursive_sanitize(raw_response)
 
     return clean_response, output
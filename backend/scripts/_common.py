@@ -0,0 +1,26 @@
+"""Shared helpers for the one-shot admin scripts."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.config import settings
+
+
+def get_engine() -> AsyncEngine:
+    """Create the async engine for a one-shot script.
+
+    One connection is enough for these scripts, and echo stays off —
+    logging every statement through Python logging dominated the runtime
+    of create_admin.py.
+    """
+    return create_async_engine(
+        settings.DATABASE_URL,
+        echo=False,
+        pool_pre_ping=False,
+        pool_size=1,
+        max_overflow=0,
+    )
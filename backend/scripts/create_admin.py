@@ -12,16 +12,17 @@ Subsequent users should be created via the admin API.
 import argparse
 import asyncio
 import sys
+import uuid
 from pathlib import Path
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from _common import get_engine
 from app.auth.password import hash_password
-from app.config import settings
 from app.database import Base
 from app.models.tenant import Tenant
 from app.models.user import User, UserRole
@@ -41,51 +42,81 @@ async def create_admin(
         tenant_name: Name of the tenant/organization
     """
     # Create engine and session
-    engine = create_async_engine(settings.DATABASE_URL, echo=True)
+    engine = get_engine()
     async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+    # On a warm database (migrations applied) a single information_schema
+    # probe skips the create_all reflection pass (one CREATE TABLE IF NOT
+    # EXISTS roundtrip per table); on a fresh one — the bootstrap scenario
+    # this script exists for — the tables are created as before.
     async with engine.begin() as conn:
-        # Create tables if they don't exist
-        await conn.run_sync(Base.metadata.create_all)
+        exists = (
+            await conn.execute(
+                text("SELECT 1 FROM information_schema.tables WHERE table_name = 'users' LIMIT 1")
+            )
+        ).scalar()
+        if not exists:
+            await conn.run_sync(Base.metadata.create_all)
 
     async with async_session() as session:
-        # Check if user already exists
-        result = await session.execute(select(User).where(User.email == email))
-        existing_user = result.scalar_one_or_none()
-
-        if existing_user:
+        # Both existence checks in a single roundtrip via scalar subqueries
+        # (the async session runs queries serially, so two executes would be
+        # two RTTs to a remote database).
+        user_id_sq = select(User.id).where(User.email == email).scalar_subquery()
+        tenant_id_sq = select(Tenant.id).where(Tenant.name == tenant_name).scalar_subquery()
+        existing_user_id, tenant_id = (
+            await session.execute(select(user_id_sq, tenant_id_sq))
+        ).one()
+
+        if existing_user_id is not None:
             print(f"Error: User with email '{email}' already exists.")
             await engine.dispose()
             sys.exit(1)
 
-        # Check if tenant already exists
-        result = await session.execute(select(Tenant).where(Tenant.name == tenant_name))
-        tenant = result.scalar_one_or_none()
-
-        if not tenant:
-            # Create tenant
-            tenant = Tenant(name=tenant_name)
-            session.add(tenant)
-            await session.flush()  # Get the tenant ID
-            print(f"Created tenant: {tenant_name} (ID: {tenant.id})")
+        admin_id = uuid.uuid4()
+        user_params = {
+            "uid": admin_id,
+            "email": email,
+            "pwd": hash_password(password),
+            "role": UserRole.ADMIN.value,
+        }
+
+        if tenant_id is None:
+            # Create tenant and admin in a single CTE statement — one
+            # roundtrip instead of INSERT + flush + INSERT. (tenants.name has
+            # no unique constraint, so ON CONFLICT is not an option; the
+            # existence check above already decided this branch.)
+            tenant_id = uuid.uuid4()
+            await session.execute(
+                text(
+                    "WITH t AS ("
+                    "    INSERT INTO tenants (id, name, is_active, created_at)"
+                    "    VALUES (:tid, :name, TRUE, now())"
+                    "    RETURNING id"
+                    ") "
+                    "INSERT INTO users (id, tenant_id, email, hashed_password, role, is_active, created_at) "
+                    "SELECT :uid, id, :email, :pwd, :role, TRUE, now() FROM t"
+                ),
+                {"tid": tenant_id, "name": tenant_name, **user_params},
+            )
+            print(f"Created tenant: {tenant_name} (ID: {tenant_id})")
         else:
-            print(f"Using existing tenant: {tenant_name} (ID: {tenant.id})")
-
-        # Create admin user
-        admin = User(
-            email=email,
-            hashed_password=hash_password(password),
-            role=UserRole.ADMIN.value,
-            tenant_id=tenant.id,
-        )
-        session.add(admin)
+            print(f"Using existing tenant: {tenant_name} (ID: {tenant_id})")
+            await session.execute(
+                text(
+                    "INSERT INTO users (id, tenant_id, email, hashed_password, role, is_active, created_at) "
+                    "VALUES (:uid, :tid, :email, :pwd, :role, TRUE, now())"
+                ),
+                {"tid": tenant_id, **user_params},
+            )
+
         await session.commit()
 
         print(f"\nAdmin user created successfully!")
         print(f"  Email: {email}")
         print(f"  Role: admin")
         print(f"  Tenant: {tenant_name}")
-        print(f"  User ID: {admin.id}")
+        print(f"  User ID: {admin_id}")
 
     await engine.dispose()
 
@@ -15,17 +15,16 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from sqlalchemy import select, func
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from _common import get_engine
 from app.auth.password import hash_password
-from app.config import settings
-from app.database import Base
 from app.models.tenant import Tenant
 from app.models.user import User, UserRole
 
 
 async def seed():
-    engine = create_async_engine(settings.DATABASE_URL, echo=False)
+    engine = get_engine()
     async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
     async with async_session() as session:
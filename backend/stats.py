@@ -5,27 +5,26 @@ Uses in-memory counters (no external dependencies).
 from datetime import datetime
 from typing import Dict, Any
 
-_total_reconciliations = 0
-_total_rows_processed = 0
-_last_reconciliation: str | None = None
+# Single state dict: item assignment avoids the three STORE_GLOBAL rebinds
+# (and the `global` declarations) the separate module-level counters needed.
+_state: Dict[str, Any] = {
+    "total_reconciliations": 0,
+    "total_rows_processed": 0,
+    "last_reconciliation": None,
+}
 
 
 def increment_reconciliation_count(rows_processed: int = 0) -> Dict[str, Any]:
     """Increment in-memory stats counters."""
-    global _total_reconciliations, _total_rows_processed, _last_reconciliation
-    _total_reconciliations += 1
-    _total_rows_processed += rows_processed
-    _last_reconciliation = datetime.now().isoformat()
-    return {
-        "total_reconciliations": _total_reconciliations,
-        "total_rows_processed": _total_rows_processed,
-        "last_reconciliation": _last_reconciliation,
-    }
+    _state["total_reconciliations"] += 1
+    _state["total_rows_processed"] += rows_processed
+    _state["last_reconciliation"] = datetime.now().isoformat()
+    return dict(_state)
 
 
 def get_stats() -> Dict[str, Any]:
     """Get current in-memory statistics."""
     return {
-        "total_reconciliations": _total_reconciliations,
-        "total_rows_processed": _total_rows_processed,
+        "total_reconciliations": _state["total_reconciliations"],
+        "total_rows_processed": _state["total_rows_processed"],
     }
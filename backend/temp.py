@@ -1,10 +1,226 @@
-import streamlit as st, pandas as pd, numpy as np, tempfile, subprocess, sys
+import streamlit as st, pandas as pd, numpy as np, tempfile, shutil, os
 import plotly.graph_objects as go
 import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from openpyxl.utils.exceptions import InvalidFileException
 
 st.set_page_config(page_title="Conciliador Clientes/Proveedores (FIFO)", layout="wide", page_icon="📊")
 
+
+@st.cache_resource(show_spinner=False)
+def _conciliador():
+    """Importa conciliador_fifo una sola vez por proceso: el módulo (y las
+    tablas/regex compiladas a nivel de módulo de reconciliation) se comparte
+    entre sesiones en vez de re-importarse en un subproceso por clic."""
+    import conciliador_fifo
+    return conciliador_fifo
+
+
+@st.cache_data(max_entries=2)
+def _xlsx_bytes(path, mtime):
+    """Bytes del workbook conciliado, leídos del disco una sola vez por
+    (ruta, mtime) en lugar de en cada rerun del botón de descarga."""
+    return Path(path).read_bytes()
+
+
+# Desactivable con CONCILIADOR_PARALLEL_PREVIEW=0 para medir frente a las
+# lecturas secuenciales
+_PARALLEL_PREVIEW = os.environ.get("CONCILIADOR_PARALLEL_PREVIEW", "1") != "0"
+
+# calamine (Rust) parsea xlsx un orden de magnitud más rápido que openpyxl;
+# si no está instalado, todo cae al motor por defecto
+try:
+    import python_calamine  # noqa: F401
+    _EXCEL_ENGINE = "calamine"
+except ImportError:
+    _EXCEL_ENGINE = "openpyxl"
+
+
+def _open_workbook(path):
+    """ExcelFile con calamine si está disponible; openpyxl como fallback para
+    variantes de xlsx que calamine no acepte (mismo patrón que _open_excel en
+    reconciliation.py)."""
+    try:
+        return pd.ExcelFile(path, engine="calamine")
+    except (ImportError, ValueError):
+        return pd.ExcelFile(path)
+
+# Columnas tal y como las emite quick_summary en reconciliation.py
+_RESUMEN_COLS = ("Bloque", "Asignado", "Docs_pendientes",
+                 "Pagos_sin_factura_abs")
+
+# Lecturas (hoja, usecols, nrows, dtype) que la vista previa realiza; deben
+# coincidir con las llamadas a _read_sheet para que el prefetch las sirva
+_PREVIEW_READS = (
+    ("Resumen", _RESUMEN_COLS, None, (("Docs_pendientes", "int64"),)),
+    ("Clientes_Detalle", ("Estado",), None, None),
+    ("Proveedores_Detalle", ("Estado",), None, None),
+    ("Canceladas_Clientes", None, 50, None),
+    ("Canceladas_Clientes", ("Dias_hasta_pago",), None, None),
+    ("Pendientes_Clientes", None, 50, None),
+    ("Canceladas_Proveedores", None, 50, None),
+    ("Canceladas_Proveedores", ("Dias_hasta_pago",), None, None),
+    ("Pendientes_Proveedores", None, 50, None),
+    ("Multipago_Clientes", ("Num_Pagos", "Dias_Pago_Total"), None, None),
+    ("Multipago_Clientes", ("Num_Pagos",), None, None),
+    ("Multipago_Clientes", None, 20, None),
+    ("Multipago_Proveedores", ("Num_Pagos", "Dias_Pago_Total"), None, None),
+    ("Multipago_Proveedores", ("Num_Pagos",), None, None),
+    ("Multipago_Proveedores", None, 20, None),
+)
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _prefetched_frames(path_key):
+    """Realiza en paralelo las lecturas que la vista previa va a pedir.
+
+    El parseo de openpyxl está dominado por zlib y XML SAX, que liberan el
+    GIL, así que un pool de hilos solapa la descompresión entre hojas. Cada
+    hilo lee sobre la ruta con su propio handle (un ExcelFile compartido no
+    es seguro entre hilos). Las combinaciones que fallan por columnas
+    ausentes se omiten y esa sección cae a su lectura directa.
+    """
+    path = path_key[0]
+    sheet_names = _open_workbook(path).sheet_names
+    specs = [spec for spec in _PREVIEW_READS if spec[0] in sheet_names]
+    if not specs:
+        return {}
+
+    def _read(spec):
+        sheet, usecols, nrows, dtype = spec
+        try:
+            return spec, pd.read_excel(path, sheet_name=sheet,
+                                       usecols=list(usecols) if usecols is not None else None,
+                                       nrows=nrows,
+                                       dtype=dict(dtype) if dtype else None,
+                                       engine=_EXCEL_ENGINE)
+        except ValueError:
+            return spec, None
+
+    with ThreadPoolExecutor(max_workers=min(4, len(specs))) as ex:
+        return {spec: df for spec, df in ex.map(_read, specs) if df is not None}
+
+
+@st.cache_data(show_spinner=False)
+def _read_sheet(_xls, path_key, sheet_name, usecols=None, nrows=None, dtype=None):
+    """Lee una hoja del workbook ya abierto restringida a las columnas/filas
+    que la vista previa usa de verdad (el parseo de openpyxl es proporcional a
+    las celdas leídas). `_xls` queda fuera de la clave de caché; `path_key`
+    (ruta + mtime) identifica el fichero. Sirve del prefetch paralelo cuando
+    la combinación pedida está entre las conocidas."""
+    if _PARALLEL_PREVIEW:
+        spec = (sheet_name,
+                tuple(usecols) if usecols is not None else None,
+                nrows,
+                tuple(dtype.items()) if dtype else None)
+        pre = _prefetched_frames(path_key).get(spec)
+        if pre is not None:
+            return pre
+    return pd.read_excel(_xls, sheet_name=sheet_name, usecols=usecols, nrows=nrows, dtype=dtype)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _resumen_metrics(_xls, path_key):
+    """Filas de Clientes y Proveedores del Resumen, ya indexadas."""
+    resumen = _read_sheet(
+        _xls, path_key, "Resumen",
+        usecols=list(_RESUMEN_COLS),
+        dtype={"Docs_pendientes": "int64"},
+    ).set_index('Bloque')
+    return resumen.loc['Clientes'], resumen.loc['Proveedores']
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _format_resumen(_xls, path_key):
+    """Cadenas de las métricas del Resumen ya formateadas: se construyen una
+    vez por fichero en lugar de seis f-strings en cada rerun."""
+    cliente_row, prov_row = _resumen_metrics(_xls, path_key)
+    return {
+        'c_conc': f"€{cliente_row['Asignado']:,.2f}",
+        'c_pend': f"{int(cliente_row['Docs_pendientes'])}",
+        'c_snf': f"€{cliente_row['Pagos_sin_factura_abs']:,.2f}",
+        'p_conc': f"€{prov_row['Asignado']:,.2f}",
+        'p_pend': f"{int(prov_row['Docs_pendientes'])}",
+        'p_snf': f"€{prov_row['Pagos_sin_factura_abs']:,.2f}",
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _bar_figure(_xls, path_key):
+    """Barras comparativas Clientes vs Proveedores a partir del Resumen."""
+    cliente_row, prov_row = _resumen_metrics(_xls, path_key)
+    fig_bar = go.Figure(data=[
+        go.Bar(name='Clientes', x=['Conciliado', 'Pendientes'],
+               y=[cliente_row['Asignado'], cliente_row['Docs_pendientes']],
+               marker_color='#4CAF50', text=[f"€{cliente_row['Asignado']:,.0f}", f"{int(cliente_row['Docs_pendientes'])}"],
+               textposition='outside'),
+        go.Bar(name='Proveedores', x=['Conciliado', 'Pendientes'],
+               y=[prov_row['Asignado'], prov_row['Docs_pendientes']],
+               marker_color='#2196F3', text=[f"€{prov_row['Asignado']:,.0f}", f"{int(prov_row['Docs_pendientes'])}"],
+               textposition='outside')
+    ])
+    fig_bar.update_layout(title='Comparación Clientes vs Proveedores', barmode='group', height=400)
+    return fig_bar
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _estados_figure(_xls, path_key):
+    """Distribución por Estado (Clientes vs Proveedores); None si no hay datos."""
+    frames = []
+    for sheet, tipo in [('Clientes_Detalle', 'Clientes'), ('Proveedores_Detalle', 'Proveedores')]:
+        if sheet in _xls.sheet_names:
+            try:
+                s = _read_sheet(_xls, path_key, sheet, usecols=["Estado"])['Estado']
+            except ValueError:  # hoja sin columna Estado
+                continue
+            counts = s.value_counts()
+            if counts.empty:
+                continue
+            # Contar por hoja y concatenar los recuentos (pocas filas) en vez
+            # de apilar las columnas Estado completas antes de agrupar
+            frames.append(counts.rename_axis('Estado').reset_index(name='Cantidad').assign(Tipo=tipo))
+    if not frames:
+        return None
+    df_estados = pd.concat(frames, ignore_index=True)
+    return px.bar(df_estados, x='Tipo', y='Cantidad', color='Estado',
+                  title='Distribución por Estado',
+                  color_discrete_map={
+                      'CANCELADA': '#4CAF50',
+                      'PENDIENTE': '#FF9800',
+                      'PAGO SIN FACTURA': '#2196F3',
+                      'PARCIAL': '#FFC107'
+                  }, height=400)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _hist_figure(_xls, path_key, sheet_name, title, color):
+    """Distribución de número de pagos por factura para una hoja Multipago,
+    pre-agregada en el servidor: al navegador viajan K barras, no N filas."""
+    counts = _read_sheet(_xls, path_key, sheet_name, usecols=["Num_Pagos"])['Num_Pagos'].value_counts().sort_index()
+    fig = go.Figure(go.Bar(x=counts.index, y=counts.values, marker_color=color))
+    fig.update_layout(title=title, xaxis_title='Número de Pagos', yaxis_title='Cantidad')
+    return fig
+
+
+# Errores esperables de lectura/esquema del workbook de salida; todo lo demás
+# se propaga para no enmascarar bugs reales tras un st.warning genérico
+_PREVIEW_ERRORS = (FileNotFoundError, ValueError, KeyError, InvalidFileException)
+
+
+@contextmanager
+def _preview_guard(seccion):
+    """Aísla el fallo de una sección de la vista previa sin tumbar el resto.
+    Con st.session_state['debug'] activo muestra el traceback completo."""
+    try:
+        yield
+    except _PREVIEW_ERRORS as e:
+        st.warning(f"⚠️ No se pudo previsualizar {seccion}: {e}")
+        if st.session_state.get("debug"):
+            st.exception(e)
+
+
 # Título con estilo
 st.markdown("""
     <h1 style='text-align: center; color: #2E4057;'>
@@ -22,111 +238,97 @@ with st.sidebar:
     ar_prefix = st.text_input("Prefijo Clientes", value="43")
     ap_prefix = st.text_input("Prefijo Proveedores", value="4000")
     st.info("💡 **Consejo:** El prefijo debe coincidir con el inicio de las cuentas contables")
+    st.checkbox("🐞 Modo debug", key="debug", help="Muestra el traceback completo si la vista previa falla")
 
 # Área principal
 upl = st.file_uploader("📁 Sube el Excel de libro mayor", type=["xlsx"], help="Formato: 43x para clientes, 4000x para proveedores")
 
 if upl is not None:
     with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        tmp.write(upl.read()); tmp.flush(); tmp_in = Path(tmp.name)
-    script_path = Path(tempfile.gettempdir()) / "conciliador_fifo_stream.py"
-    script_path.write_text(Path("conciliador_fifo.py").read_text(encoding="utf-8"), encoding="utf-8")
+        # Copia en bloques de 1 MiB en vez de materializar el upload entero
+        # en un bytes intermedio (seek por si Streamlit ya consumió el stream)
+        upl.seek(0)
+        shutil.copyfileobj(upl, tmp, length=1 << 20)
+        tmp_in = Path(tmp.name)
     out_path = tmp_in.with_name(tmp_in.stem + "_conciliado.xlsx")
 
     if st.button("🚀 Ejecutar conciliación", type="primary", use_container_width=True):
+        run_error = None
         with st.spinner("Procesando conciliación..."):
-            cmd = [sys.executable, str(script_path), str(tmp_in), "--tol", str(tol),
-                   "--ar-prefix", ar_prefix, "--ap-prefix", ap_prefix, "-o", str(out_path)]
-            res = subprocess.run(cmd, capture_output=True, text=True)
+            try:
+                # Llamada en proceso: sin arranque de intérprete ni
+                # re-importación de pandas/numpy/openpyxl por ejecución
+                _conciliador().run(tmp_in, tol=tol, ar_prefix=ar_prefix,
+                                   ap_prefix=ap_prefix, output_path=out_path)
+                # El fichero de salida acaba de cambiar: descartar las hojas,
+                # métricas y figuras cacheadas de la ejecución anterior
+                st.cache_data.clear()
+            except Exception as e:
+                run_error = e
 
-        if res.returncode != 0:
-            st.error("❌ Error en la conciliación: " + res.stderr[:4000])
+        if run_error is not None:
+            st.error(f"❌ Error en la conciliación: {run_error}")
         else:
             st.success("✅ Conciliación completada exitosamente")
 
             # Botón de descarga destacado
-            with open(out_path, "rb") as f:
-                st.download_button(
-                    "⬇️ Descargar Excel conciliado",
-                    f,
-                    file_name=out_path.name,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    type="primary",
-                    use_container_width=True
-                )
+            st.download_button(
+                "⬇️ Descargar Excel conciliado",
+                data=_xlsx_bytes(str(out_path), out_path.stat().st_mtime_ns),
+                file_name=out_path.name,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                type="primary",
+                use_container_width=True
+            )
 
             # Visualización de resultados
-            try:
-                xls = pd.ExcelFile(out_path)
+            with st.expander("📈 Ver resultados detallados", expanded=False), \
+                    _preview_guard("los resultados"):
+                xls = _open_workbook(out_path)
+
+                # Un solo parseo del contenedor zip vía el handle compartido;
+                # cada lectura posterior se limita con usecols/nrows a lo que
+                # la vista previa consume y queda cacheada por hoja
+                path_key = (str(out_path), out_path.stat().st_mtime_ns)
 
                 # Resumen con métricas
                 if "Resumen" in xls.sheet_names:
                     st.markdown("---")
                     st.header("📈 Resumen Ejecutivo")
 
-                    resumen = pd.read_excel(out_path, sheet_name="Resumen")
+                    with _preview_guard("el Resumen Ejecutivo"):
+                        fmt = _format_resumen(xls, path_key)
 
-                    # Métricas en columnas
-                    col1, col2 = st.columns(2)
+                        # Métricas en columnas
+                        col1, col2 = st.columns(2)
 
-                    with col1:
-                        st.subheader("👥 Clientes")
-                        cliente_row = resumen[resumen['Bloque'] == 'Clientes'].iloc[0]
-                        c1, c2, c3 = st.columns(3)
-                        c1.metric("💰 Conciliado", f"€{cliente_row['Conciliado']:,.2f}", help="Total de facturas cobradas")
-                        c2.metric("⚠️ Pendientes", f"{int(cliente_row['Facturas_pendientes'])}", help="Facturas sin cobrar")
-                        c3.metric("🔍 Sin Factura", f"€{abs(cliente_row['Cobros_sin_factura']):,.2f}", help="Cobros sin factura asociada")
+                        with col1:
+                            st.subheader("👥 Clientes")
+                            c1, c2, c3 = st.columns(3)
+                            c1.metric("💰 Conciliado", fmt['c_conc'], help="Total de facturas cobradas")
+                            c2.metric("⚠️ Pendientes", fmt['c_pend'], help="Facturas sin cobrar")
+                            c3.metric("🔍 Sin Factura", fmt['c_snf'], help="Cobros sin factura asociada")
 
-                    with col2:
-                        st.subheader("🏢 Proveedores")
-                        prov_row = resumen[resumen['Bloque'] == 'Proveedores'].iloc[0]
-                        p1, p2, p3 = st.columns(3)
-                        p1.metric("💰 Conciliado", f"€{prov_row['Conciliado']:,.2f}", help="Total de facturas pagadas")
-                        p2.metric("⚠️ Pendientes", f"{int(prov_row['Facturas_pendientes'])}", help="Facturas sin pagar")
-                        p3.metric("🔍 Sin Factura", f"€{abs(prov_row['Pagos_sin_factura']):,.2f}", help="Pagos sin factura asociada")
+                        with col2:
+                            st.subheader("🏢 Proveedores")
+                            p1, p2, p3 = st.columns(3)
+                            p1.metric("💰 Conciliado", fmt['p_conc'], help="Total de facturas pagadas")
+                            p2.metric("⚠️ Pendientes", fmt['p_pend'], help="Facturas sin pagar")
+                            p3.metric("🔍 Sin Factura", fmt['p_snf'], help="Pagos sin factura asociada")
 
-                    # Gráficos comparativos
-                    st.markdown("---")
-                    col_chart1, col_chart2 = st.columns(2)
-
-                    with col_chart1:
-                        # Gráfico de barras comparativo
-                        fig_bar = go.Figure(data=[
-                            go.Bar(name='Clientes', x=['Conciliado', 'Pendientes'],
-                                   y=[cliente_row['Conciliado'], cliente_row['Facturas_pendientes']],
-                                   marker_color='#4CAF50', text=[f"€{cliente_row['Conciliado']:,.0f}", f"{int(cliente_row['Facturas_pendientes'])}"],
-                                   textposition='outside'),
-                            go.Bar(name='Proveedores', x=['Conciliado', 'Pendientes'],
-                                   y=[prov_row['Conciliado'], prov_row['Facturas_pendientes']],
-                                   marker_color='#2196F3', text=[f"€{prov_row['Conciliado']:,.0f}", f"{int(prov_row['Facturas_pendientes'])}"],
-                                   textposition='outside')
-                        ])
-                        fig_bar.update_layout(title='Comparación Clientes vs Proveedores', barmode='group', height=400)
-                        st.plotly_chart(fig_bar, use_container_width=True)
-
-                    with col_chart2:
-                        # Gráfico de estado por tipo
-                        estados_data = []
-                        for sheet in ['Clientes_Detalle', 'Proveedores_Detalle']:
-                            if sheet in xls.sheet_names:
-                                df_det = pd.read_excel(out_path, sheet_name=sheet)
-                                if 'Estado' in df_det.columns:
-                                    tipo = 'Clientes' if 'Clientes' in sheet else 'Proveedores'
-                                    counts = df_det['Estado'].value_counts()
-                                    for estado, count in counts.items():
-                                        estados_data.append({'Tipo': tipo, 'Estado': estado, 'Cantidad': count})
-
-                        if estados_data:
-                            df_estados = pd.DataFrame(estados_data)
-                            fig_estados = px.bar(df_estados, x='Tipo', y='Cantidad', color='Estado',
-                                               title='Distribución por Estado',
-                                               color_discrete_map={
-                                                   'CANCELADA': '#4CAF50',
-                                                   'PENDIENTE': '#FF9800',
-                                                   'PAGO SIN FACTURA': '#2196F3',
-                                                   'PARCIAL': '#FFC107'
-                                               }, height=400)
-                            st.plotly_chart(fig_estados, use_container_width=True)
+                        # Gráficos comparativos
+                        st.markdown("---")
+                        col_chart1, col_chart2 = st.columns(2)
+
+                        with col_chart1:
+                            # Gráfico de barras comparativo
+                            st.plotly_chart(_bar_figure(xls, path_key), use_container_width=True)
+
+                        with col_chart2:
+                            # Gráfico de estado por tipo
+                            fig_estados = _estados_figure(xls, path_key)
+                            if fig_estados is not None:
+                                st.plotly_chart(fig_estados, use_container_width=True)
 
                 # Tablas de pendientes y canceladas
                 st.markdown("---")
@@ -138,59 +340,71 @@ if upl is not None:
                     "📊 Análisis Multipago"
                 ])
 
-                with tab1:
+                with tab1, _preview_guard("las facturas canceladas de clientes"):
                     if "Canceladas_Clientes" in xls.sheet_names:
-                        canc_cli = pd.read_excel(out_path, sheet_name="Canceladas_Clientes")
+                        canc_cli = _read_sheet(xls, path_key, "Canceladas_Clientes", nrows=50)
                         if not canc_cli.empty:
-                            st.success(f"✅ {len(canc_cli)} facturas de clientes emparejadas correctamente")
-                            # Mostrar estadísticas de días hasta pago
+                            # Estadísticas de días hasta pago: una sola columna
+                            # a lo largo de toda la hoja (da también el total)
                             if 'Dias_hasta_pago' in canc_cli.columns:
+                                dias = _read_sheet(xls, path_key, "Canceladas_Clientes", usecols=["Dias_hasta_pago"])['Dias_hasta_pago']
+                            else:
+                                dias = None
+                            total = len(dias) if dias is not None else len(_read_sheet(xls, path_key, "Canceladas_Clientes", usecols=[0]))
+                            st.success(f"✅ {total} facturas de clientes emparejadas correctamente")
+                            if dias is not None:
                                 col_stats1, col_stats2, col_stats3 = st.columns(3)
-                                col_stats1.metric("⏱️ Días promedio", f"{canc_cli['Dias_hasta_pago'].mean():.0f}")
-                                col_stats2.metric("⚡ Pago más rápido", f"{canc_cli['Dias_hasta_pago'].min():.0f} días")
-                                col_stats3.metric("🐌 Pago más lento", f"{canc_cli['Dias_hasta_pago'].max():.0f} días")
-                            st.dataframe(canc_cli.head(50), use_container_width=True, height=400)
-                            st.caption(f"Mostrando 50 de {len(canc_cli)} facturas canceladas")
+                                col_stats1.metric("⏱️ Días promedio", f"{dias.mean():.0f}")
+                                col_stats2.metric("⚡ Pago más rápido", f"{dias.min():.0f} días")
+                                col_stats3.metric("🐌 Pago más lento", f"{dias.max():.0f} días")
+                            st.dataframe(canc_cli, use_container_width=True, height=400)
+                            st.caption(f"Mostrando 50 de {total} facturas canceladas")
                         else:
                             st.info("No hay facturas canceladas de clientes")
 
-                with tab2:
+                with tab2, _preview_guard("las facturas pendientes de clientes"):
                     if "Pendientes_Clientes" in xls.sheet_names:
-                        pend_cli = pd.read_excel(out_path, sheet_name="Pendientes_Clientes")
+                        pend_cli = _read_sheet(xls, path_key, "Pendientes_Clientes", nrows=50)
                         if not pend_cli.empty:
-                            st.warning(f"⚠️ {len(pend_cli)} facturas de clientes pendientes")
-                            st.dataframe(pend_cli.head(50), use_container_width=True, height=400)
-                            st.caption(f"Mostrando 50 de {len(pend_cli)} facturas pendientes")
+                            total = len(_read_sheet(xls, path_key, "Pendientes_Clientes", usecols=[0]))
+                            st.warning(f"⚠️ {total} facturas de clientes pendientes")
+                            st.dataframe(pend_cli, use_container_width=True, height=400)
+                            st.caption(f"Mostrando 50 de {total} facturas pendientes")
                         else:
                             st.success("✅ No hay facturas pendientes de clientes")
 
-                with tab3:
+                with tab3, _preview_guard("las facturas canceladas de proveedores"):
                     if "Canceladas_Proveedores" in xls.sheet_names:
-                        canc_prov = pd.read_excel(out_path, sheet_name="Canceladas_Proveedores")
+                        canc_prov = _read_sheet(xls, path_key, "Canceladas_Proveedores", nrows=50)
                         if not canc_prov.empty:
-                            st.success(f"✅ {len(canc_prov)} facturas de proveedores emparejadas correctamente")
-                            # Mostrar estadísticas de días hasta pago
                             if 'Dias_hasta_pago' in canc_prov.columns:
+                                dias = _read_sheet(xls, path_key, "Canceladas_Proveedores", usecols=["Dias_hasta_pago"])['Dias_hasta_pago']
+                            else:
+                                dias = None
+                            total = len(dias) if dias is not None else len(_read_sheet(xls, path_key, "Canceladas_Proveedores", usecols=[0]))
+                            st.success(f"✅ {total} facturas de proveedores emparejadas correctamente")
+                            if dias is not None:
                                 col_stats1, col_stats2, col_stats3 = st.columns(3)
-                                col_stats1.metric("⏱️ Días promedio", f"{canc_prov['Dias_hasta_pago'].mean():.0f}")
-                                col_stats2.metric("⚡ Pago más rápido", f"{canc_prov['Dias_hasta_pago'].min():.0f} días")
-                                col_stats3.metric("🐌 Pago más lento", f"{canc_prov['Dias_hasta_pago'].max():.0f} días")
-                            st.dataframe(canc_prov.head(50), use_container_width=True, height=400)
-                            st.caption(f"Mostrando 50 de {len(canc_prov)} facturas canceladas")
+                                col_stats1.metric("⏱️ Días promedio", f"{dias.mean():.0f}")
+                                col_stats2.metric("⚡ Pago más rápido", f"{dias.min():.0f} días")
+                                col_stats3.metric("🐌 Pago más lento", f"{dias.max():.0f} días")
+                            st.dataframe(canc_prov, use_container_width=True, height=400)
+                            st.caption(f"Mostrando 50 de {total} facturas canceladas")
                         else:
                             st.info("No hay facturas canceladas de proveedores")
 
-                with tab4:
+                with tab4, _preview_guard("las facturas pendientes de proveedores"):
                     if "Pendientes_Proveedores" in xls.sheet_names:
-                        pend_prov = pd.read_excel(out_path, sheet_name="Pendientes_Proveedores")
+                        pend_prov = _read_sheet(xls, path_key, "Pendientes_Proveedores", nrows=50)
                         if not pend_prov.empty:
-                            st.warning(f"⚠️ {len(pend_prov)} facturas de proveedores pendientes")
-                            st.dataframe(pend_prov.head(50), use_container_width=True, height=400)
-                            st.caption(f"Mostrando 50 de {len(pend_prov)} facturas pendientes")
+                            total = len(_read_sheet(xls, path_key, "Pendientes_Proveedores", usecols=[0]))
+                            st.warning(f"⚠️ {total} facturas de proveedores pendientes")
+                            st.dataframe(pend_prov, use_container_width=True, height=400)
+                            st.caption(f"Mostrando 50 de {total} facturas pendientes")
                         else:
                             st.success("✅ No hay facturas pendientes de proveedores")
 
-                with tab5:
+                with tab5, _preview_guard("el análisis multipago"):
                     st.header("📊 Análisis de Facturas con Múltiples Pagos")
 
                     # Datos de multipago
@@ -202,7 +416,7 @@ if upl is not None:
 
                         with col_m1:
                             if multi_cli_exists:
-                                multi_cli = pd.read_excel(out_path, sheet_name="Multipago_Clientes")
+                                multi_cli = _read_sheet(xls, path_key, "Multipago_Clientes", usecols=["Num_Pagos", "Dias_Pago_Total"])
                                 if not multi_cli.empty:
                                     st.subheader("👥 Clientes - Multipago")
                                     st.info(f"📋 {len(multi_cli)} facturas con múltiples pagos")
@@ -214,21 +428,19 @@ if upl is not None:
                                     mcol3.metric("Días promedio", f"{multi_cli['Dias_Pago_Total'].mean():.0f}")
 
                                     # Gráfico de distribución
-                                    fig_dist_cli = px.histogram(multi_cli, x='Num_Pagos',
-                                                               title='Distribución de Número de Pagos (Clientes)',
-                                                               labels={'Num_Pagos': 'Número de Pagos', 'count': 'Cantidad'},
-                                                               color_discrete_sequence=['#4CAF50'])
+                                    fig_dist_cli = _hist_figure(xls, path_key, "Multipago_Clientes",
+                                                                'Distribución de Número de Pagos (Clientes)', '#4CAF50')
                                     st.plotly_chart(fig_dist_cli, use_container_width=True)
 
                                     # Tabla
-                                    st.dataframe(multi_cli.head(20), use_container_width=True, height=300)
+                                    st.dataframe(_read_sheet(xls, path_key, "Multipago_Clientes", nrows=20), use_container_width=True, height=300)
                                     st.caption(f"Mostrando 20 de {len(multi_cli)} facturas multipago")
                                 else:
                                     st.success("✅ No hay facturas de clientes con múltiples pagos")
 
                         with col_m2:
                             if multi_prov_exists:
-                                multi_prov = pd.read_excel(out_path, sheet_name="Multipago_Proveedores")
+                                multi_prov = _read_sheet(xls, path_key, "Multipago_Proveedores", usecols=["Num_Pagos", "Dias_Pago_Total"])
                                 if not multi_prov.empty:
                                     st.subheader("🏢 Proveedores - Multipago")
                                     st.info(f"📋 {len(multi_prov)} facturas con múltiples pagos")
@@ -240,19 +452,14 @@ if upl is not None:
                                     mcol3.metric("Días promedio", f"{multi_prov['Dias_Pago_Total'].mean():.0f}")
 
                                     # Gráfico de distribución
-                                    fig_dist_prov = px.histogram(multi_prov, x='Num_Pagos',
-                                                                title='Distribución de Número de Pagos (Proveedores)',
-                                                                labels={'Num_Pagos': 'Número de Pagos', 'count': 'Cantidad'},
-                                                                color_discrete_sequence=['#2196F3'])
+                                    fig_dist_prov = _hist_figure(xls, path_key, "Multipago_Proveedores",
+                                                                 'Distribución de Número de Pagos (Proveedores)', '#2196F3')
                                     st.plotly_chart(fig_dist_prov, use_container_width=True)
 
                                     # Tabla
-                                    st.dataframe(multi_prov.head(20), use_container_width=True, height=300)
+                                    st.dataframe(_read_sheet(xls, path_key, "Multipago_Proveedores", nrows=20), use_container_width=True, height=300)
                                     st.caption(f"Mostrando 20 de {len(multi_prov)} facturas multipago")
                                 else:
                                     st.success("✅ No hay facturas de proveedores con múltiples pagos")
                     else:
-                        st.info("No hay datos de multipago disponibles")
-
-            except Exception as e:
-                st.warning(f"⚠️ No se pudo previsualizar los resultados: {e}")
\ No newline at end of file
+                        st.info("No hay datos de multipago disponibles")
\ No newline at end of file